@@ -0,0 +1,386 @@
+#!/usr/bin/python
+#
+# benchmarks for the game engine, run from this directory:
+#   python benchmarks.py [--no-render] [results.json]
+#
+# every benchmark uses fixed random seeds. results are written as JSON (to the
+# given file, or stdout) so runs from different releases can be compared.
+#
+import os
+import sys
+import json
+import shutil
+import tempfile
+import platform
+import timeit
+import game
+import flowfield
+import libtcodpy as libtcod
+
+SEED = 1234
+#every tenth level has the boss layout instead of rooms and tunnels: time those apart
+LEVELS = [1, 9, 49, 99]
+BOSS_LEVELS = [10, 100]
+MONSTER_COUNTS = [10, 100, 1000]
+NUM_OBJECTS = 3000
+IDLE_SECONDS = 3
+
+def timed(func, repeat):
+    #call func repeat times, return the mean time of one call in seconds
+    start = timeit.default_timer()
+    for i in range(repeat):
+        func()
+    return (timeit.default_timer() - start) / repeat
+
+def new_game():
+    game.new_game(SEED)
+    #the player must survive every benchmark
+    game.player.fighter.hp = game.player.fighter.max_hp = 1000000
+
+def linear_objects_at(x, y):
+    #the old way of finding objects on a tile: walk the whole list
+    return [obj for obj in game.objects if obj.x == x and obj.y == y]
+
+def populate(num_objects, items = True):
+    #fill the current level with objects on random floor tiles. monsters need a free
+    #tile, so when there is none left (or items is true, every other time) an item is
+    #placed instead: items can pile up
+    rnd = libtcod.random_new_from_seed(SEED)
+    floor = [(x, y) for y in range(game.MAP_HEIGHT) for x in range(game.MAP_WIDTH) if not game.map[x][y].blocked]
+    for i in range(num_objects):
+        x, y = floor[libtcod.random_get_int(rnd, 0, len(floor) - 1)]
+        if (i % 2 == 0 or not items) and not game.is_blocked(x, y):
+            fighter_component = game.Fighter(hp = 10, defense = 0, power = 1, xp = 0, death_function = game.monster_death)
+            obj = game.Object(x, y, 's', 'spider', libtcod.red, blocks = True, fighter = fighter_component, ai = game.BasicMonster())
+        else:
+            item_component = game.Item(use_function = game.cast_heal, strength = 1)
+            obj = game.Object(x, y, '!', 'healing potion I', libtcod.pink, item = item_component)
+        game.add_object(obj)
+    libtcod.random_delete(rnd)
+
+def count_monsters():
+    return len([obj for obj in game.objects if obj.ai])
+
+def monster_turns():
+    #every awake monster takes its turn
+    game.take_monster_turns()
+
+def full_turn():
+    #the player moves (or attacks), then every monster takes its turn
+    game.recompute_fov()
+    game.player_move_or_attack(1, 0)
+    monster_turns()
+
+def bench_make_map():
+    results = []
+    new_game()
+    for level in LEVELS + BOSS_LEVELS:
+        game.dungeon_level = level
+        mean = timed(game.make_map, 20)
+        results.append({'name': 'make_map', 'dungeon_level': level, 'boss_level': level in BOSS_LEVELS,
+                        'seconds': mean, 'objects': len(game.objects)})
+    return results
+
+def bench_monster_turns():
+    results = []
+    for count in MONSTER_COUNTS:
+        new_game()
+        populate(count, items = False)
+        game.recompute_fov()
+        mean = timed(monster_turns, 20)
+        results.append({'name': 'monster_turns', 'monsters': count_monsters(), 'awake': len(game.active_monsters), 'seconds': mean})
+    return results
+
+def bench_full_turn():
+    #a full turn on a crowded level, with the tile index and with linear scans
+    indexed_objects_at = game.objects_at
+    new_game()
+    populate(NUM_OBJECTS)
+
+    indexed = timed(full_turn, 20)
+    game.objects_at = linear_objects_at
+    try:
+        linear = timed(full_turn, 5)
+    finally:
+        game.objects_at = indexed_objects_at
+
+    objects = len(game.objects)
+    return [{'name': 'full_turn', 'objects': objects, 'index': True, 'seconds': indexed},
+            {'name': 'full_turn', 'objects': objects, 'index': False, 'seconds': linear}]
+
+def bench_next_level():
+    #taking the stairs, with the level generated on demand and pre-generated in the background
+    results = []
+    for pregenerate in (False, True):
+        game.pregenerate_levels = pregenerate
+        new_game()
+        total = 0.0
+        for i in range(20):
+            if game.level_job is not None:
+                #let the worker finish first, as it would while the player walks to the stairs
+                game.level_job.join()
+            total += timed(game.next_level, 1)
+        results.append({'name': 'next_level', 'pregenerated': pregenerate, 'seconds': total / 20})
+    game.pregenerate_levels = True
+    return results
+
+def bench_render():
+    new_game()
+    def with_fov():
+        game.fov_recompute = True
+        game.render_all()
+    return [{'name': 'render_all', 'fov_recompute': True, 'seconds': timed(with_fov, 100)},
+            {'name': 'render_all', 'fov_recompute': False, 'seconds': timed(game.render_all, 100)}]
+
+def bench_console_buffer():
+    #a full-screen update (every cell gets new colors and a new character) written to an
+    #offscreen console, with the list-based ConsoleBuffer and cell by cell, and with the
+    #NumPy one and a single set_rect
+    width, height = game.SCREEN_WIDTH, game.SCREEN_HEIGHT
+    con = libtcod.console_new(width, height)
+    cells = [(x, y) for y in range(height) for x in range(width)]
+    def list_update(buffer):
+        for x, y in cells:
+            buffer.set(x, y, x, y, x ^ y, 255 - x, 255 - y, x & y, chr(32 + (x + y) % 95))
+        buffer.blit(con)
+    buffers = [('list', libtcod.ConsoleBuffer(width, height), list_update)]
+    if libtcod.numpy_available:
+        numpy = libtcod.numpy
+        y, x = numpy.mgrid[:height, :width]
+        back = (x, y, x ^ y)
+        fore = (255 - x, 255 - y, x & y)
+        char = 32 + (x + y) % 95
+        def numpy_update(buffer):
+            buffer.set_rect(0, 0, width, height, back, fore, char)
+            buffer.blit(con)
+        buffers.append(('numpy', libtcod.NumpyConsoleBuffer(width, height), numpy_update))
+
+    results = []
+    for kind, buffer, update in buffers:
+        mean = timed(lambda: update(buffer), 100)
+        results.append({'name': 'console_buffer', 'buffer': kind, 'cells': len(cells), 'seconds': mean})
+    libtcod.console_delete(con)
+    return results
+
+def bench_console_fill():
+    #the last step of each frame of the python fast render sample (render_py in samples_py):
+    #filling the background from float colors, on its console and on one of the game's
+    #size. with lists, and with NumPy as float arrays (converted to C ints on each call),
+    #as arrays of C ints (passed as they are) and packed into three bytes per tile
+    results = []
+    for width, height in [(46, 20), (game.SCREEN_WIDTH, game.SCREEN_HEIGHT)]:
+        con = libtcod.console_new(width, height)
+        n = width * height
+        colors = [[(i * k) % 256 + 0.5 for i in range(n)] for k in (3, 5, 7)]
+        def lists():
+            libtcod.console_fill_background(con, *[[int(c) for c in plane] for plane in colors])
+        fills = [('lists', lists)]
+        if libtcod.numpy_available:
+            numpy = libtcod.numpy
+            R, G, B = [numpy.array(plane).reshape(height, width) for plane in colors]
+            ints = [numpy.empty((height, width), dtype=numpy.intc) for i in range(3)]
+            rgb = numpy.empty((height, width, 3), dtype=numpy.uint8)
+            def as_ints():
+                for plane, out in zip((R, G, B), ints):
+                    out[...] = plane
+                libtcod.console_fill_background(con, *ints)
+            def packed():
+                for i, plane in enumerate((R, G, B)):
+                    rgb[..., i] = plane
+                libtcod.console_fill_background_rgb(con, rgb)
+            fills += [('float', lambda: libtcod.console_fill_background(con, R, G, B)),
+                      ('intc', as_ints), ('packed', packed)]
+        for kind, fill in fills:
+            results.append({'name': 'console_fill', 'colors': kind, 'cells': n, 'seconds': timed(fill, 200)})
+        libtcod.console_delete(con)
+    return results
+
+def bench_put_chars():
+    #drawing the glyphs of objects on an offscreen console, one by one through libtcod and
+    #with one console_put_chars call: from the few a turn usually changes to a crowd
+    rnd = libtcod.random_new_from_seed(SEED)
+    con = libtcod.console_new(game.MAP_WIDTH, game.MAP_HEIGHT)
+    colors = [libtcod.red, libtcod.pink, libtcod.dark_red, libtcod.violet]
+    results = []
+    for count in [2, 5, 10, 100, 1000]:
+        glyphs = [(libtcod.random_get_int(rnd, 0, game.MAP_WIDTH - 1), libtcod.random_get_int(rnd, 0, game.MAP_HEIGHT - 1),
+                   '%s!' [i % 2], colors[i % len(colors)]) for i in range(count)]
+        def one_by_one():
+            for x, y, char, color in glyphs:
+                libtcod.console_set_default_foreground(con, color)
+                libtcod.console_put_char(con, x, y, char, libtcod.BKGND_NONE)
+        xs, ys, chars, fores = zip(*glyphs)
+        batched = lambda: libtcod.console_put_chars(con, xs, ys, chars, fores)
+        for batch, draw in [(False, one_by_one), (True, batched)]:
+            results.append({'name': 'put_chars', 'glyphs': count, 'batch': batch, 'seconds': timed(draw, 100)})
+    libtcod.console_delete(con)
+    libtcod.random_delete(rnd)
+    return results
+
+def bench_save_load():
+    #without a worker generating the next level after each load
+    game.pregenerate_levels = False
+    new_game()
+    folder = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(folder, 'savegame')
+        save = timed(lambda: game.save_game(filename), 20)
+        size = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f)))
+        load = timed(lambda: game.load_game(filename), 20)
+    finally:
+        shutil.rmtree(folder)
+        game.pregenerate_levels = True
+    return [{'name': 'save_game', 'seconds': save, 'bytes': size},
+            {'name': 'load_game', 'seconds': load, 'bytes': size}]
+
+def bench_autosave():
+    #a journal entry after a full turn on a crowded level, against a whole savegame
+    game.pregenerate_levels = False
+    new_game()
+    populate(NUM_OBJECTS)
+    folder = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(folder, 'savegame')
+        save = timed(lambda: game.save_game(filename), 5)
+        turn = timed(full_turn, 20)
+        def turn_and_entry():
+            full_turn()
+            game.journal.write()
+        entry = timed(turn_and_entry, 20) - turn
+        size = os.path.getsize(filename + '.journal') / 20
+    finally:
+        shutil.rmtree(folder)
+        game.pregenerate_levels = True
+    return [{'name': 'autosave', 'objects': len(game.objects), 'journal_entry_seconds': entry,
+             'journal_entry_bytes': size, 'save_game_seconds': save}]
+
+def bench_distance_map():
+    #distance maps on the start level: libtcod's dijkstra (one run per goal), against the
+    #NumPy wavefront and the pure python dijkstra of flowfield, from the player alone and
+    #from the player, the stairs and every item at once
+    new_game()
+    player_goal = [(game.player.x, game.player.y)]
+    all_goals = player_goal + [(game.stairs.x, game.stairs.y)] + [(obj.x, obj.y) for obj in game.objects if obj.item]
+    def libtcod_distances(goals):
+        distances = None
+        for x, y in goals:
+            libtcod.dijkstra_compute(game.path_map, x, y)
+            new = libtcod.dijkstra_get_distances(game.path_map)
+            if distances is None:
+                distances = new
+            elif game.numpy_available:
+                distances = game.numpy.minimum(distances, new)
+            else:
+                distances = map(min, distances, new)
+        return distances
+    engines = [('libtcod', libtcod_distances)]
+    if flowfield.numpy_available:
+        engines.append(('numpy', lambda goals: flowfield._numpy_distance_map(game.map.blocked,
+            game.MAP_WIDTH, game.MAP_HEIGHT, goals, None, flowfield.DIAGONAL_COST)))
+    engines.append(('python', lambda goals: flowfield._python_distance_map(game.map.blocked,
+        game.MAP_WIDTH, game.MAP_HEIGHT, goals, None, flowfield.DIAGONAL_COST)))
+
+    results = []
+    for engine, func in engines:
+        for goals in (player_goal, all_goals):
+            mean = timed(lambda: func(goals), 20)
+            results.append({'name': 'distance_map', 'engine': engine, 'goals': len(goals), 'seconds': mean})
+    return results
+
+def bench_explore(render = True):
+    #auto-explore the start level (without its monsters), stepping only, and drawing every
+    #step or only every TRAVEL_RENDER_STEPS steps as the game does
+    results = []
+    for draw_every in ([None, 1, game.TRAVEL_RENDER_STEPS] if render else [None]):
+        new_game()
+        for obj in [obj for obj in game.objects if obj.ai]:
+            game.remove_object(obj)
+        frames = 0
+        start = timeit.default_timer()
+        game.start_travel('explore')
+        while game.travel_goal is not None:
+            if draw_every and game.travel_steps % draw_every == 0:
+                game.render_all()
+                libtcod.console_flush()
+                frames += 1
+            game.travel_step()
+        seconds = timeit.default_timer() - start
+        results.append({'name': 'explore', 'steps': game.travel_steps, 'frames': frames, 'seconds': seconds})
+    return results
+
+def bench_message():
+    new_game()
+    count = 10000
+    mean = timed(lambda: game.message('The weak spider attacks player for 3 hit points.', libtcod.white), count)
+    return [{'name': 'message', 'seconds': mean, 'per_second': 1.0 / mean}]
+
+def bench_idle():
+    #process CPU time per second while nobody touches the game: polling and drawing every
+    #frame, as the game loop did before, against sleeping in wait_for_input, which gives up
+    #when the time is over. only meaningful with a real window, where sleeping does sleep
+    new_game()
+    def poll_every_frame(seconds):
+        #the whole screen every frame, console_flush keeping it to LIMIT_FPS
+        libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS|libtcod.EVENT_MOUSE, game.key, game.mouse)
+        game.redraw_screen()
+        game.render_all()
+        libtcod.console_flush()
+    def wait_for_input(seconds):
+        if game.render_all():
+            libtcod.console_flush()
+        game.wait_for_input(int(seconds * 1000))
+    def cpu_per_second(func):
+        start, start_cpu = timeit.default_timer(), sum(os.times()[:2])
+        while timeit.default_timer() - start < IDLE_SECONDS:
+            func(IDLE_SECONDS - (timeit.default_timer() - start))
+        return (sum(os.times()[:2]) - start_cpu) / (timeit.default_timer() - start)
+
+    return [{'name': 'idle', 'loop': loop, 'cpu_seconds_per_second': cpu_per_second(func)}
+            for loop, func in [('poll_every_frame', poll_every_frame), ('wait_for_input', wait_for_input)]]
+
+def run(render = True):
+    results = []
+    results += bench_make_map()
+    results += bench_monster_turns()
+    results += bench_full_turn()
+    results += bench_next_level()
+    if render:
+        results += bench_render()
+        results += bench_console_buffer()
+        results += bench_console_fill()
+        results += bench_put_chars()
+    results += bench_save_load()
+    results += bench_autosave()
+    results += bench_distance_map()
+    results += bench_explore(render)
+    results += bench_message()
+    if render:
+        results += bench_idle()
+    #levels left during the benchmarks may have been spilled to a temporary directory
+    game.level_store.reset()
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'numpy': game.numpy_available, 'seed': SEED, 'results': results}
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    render = '--no-render' not in args
+    args = [arg for arg in args if arg != '--no-render']
+
+    if render:
+        #rendering needs the root console (and so a window)
+        libtcod.console_init_root(game.SCREEN_WIDTH, game.SCREEN_HEIGHT, 'Benchmarks', False)
+
+    #anything the game prints goes to stderr, so stdout only gets the JSON
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        results = run(render)
+    finally:
+        sys.stdout = stdout
+
+    output = json.dumps(results, indent = 2, sort_keys = True)
+    if args:
+        with open(args[0], 'w') as file:
+            file.write(output + '\n')
+    else:
+        print output
@@ -1088,6 +1088,10 @@ def setup_protos(lib):
     lib.TCOD_console_fill_char.restype=c_void
     lib.TCOD_console_fill_char.argtypes=[c_void_p , POINTER(c_int)]
 
+    if hasattr(lib, 'TCOD_console_put_chars'):
+        lib.TCOD_console_put_chars.restype=c_void
+        lib.TCOD_console_put_chars.argtypes=[c_void_p , c_int, POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int)]
+
     lib.TCOD_console_double_hline.restype=c_void
     lib.TCOD_console_double_hline.argtypes=[c_void_p ,c_int,c_int, c_int]
 
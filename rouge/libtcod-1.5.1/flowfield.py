@@ -0,0 +1,92 @@
+#
+# distance maps (flow fields) over the game's map layers, without a TCOD map.
+#
+# distance_map() floods out from any number of goal tiles at once, with an
+# optional cost for entering each tile. anything can then walk towards the
+# nearest goal by stepping to the neighbouring tile with the lowest distance
+# (see Object.move_downhill in game.py).
+#
+# layers are flat, row by row: tile (x, y) is at index y * width + x.
+#
+import heapq
+
+try:  #import NumPy if available
+    import numpy
+    numpy_available = True
+except ImportError:
+    numpy_available = False
+
+#cost of a diagonal step, relative to a straight one (as in libtcod's dijkstra)
+DIAGONAL_COST = 1.41
+
+#distance of a tile that can't reach any goal
+UNREACHABLE = float('inf')
+
+#steps to the neighbouring tiles, with their cost factor
+STEPS = [(0, -1, 1.0), (0, 1, 1.0), (-1, 0, 1.0), (1, 0, 1.0)]
+
+def distance_map(blocked, width, height, goals, costs = None, diagonal = DIAGONAL_COST):
+    #the walking distance from every tile to the closest of the goal tiles, (x, y) pairs.
+    #blocked holds one boolean per tile. costs, if given, holds the cost of entering each
+    #tile (1 everywhere otherwise). returns a NumPy float array if NumPy is available, a
+    #list otherwise. tiles that can't reach a goal are UNREACHABLE
+    if len(blocked) != width * height or (costs is not None and len(costs) != width * height):
+        raise ValueError('blocked and costs must have one value per tile.')
+    goals = [(x, y) for x, y in goals if 0 <= x < width and 0 <= y < height]
+    if numpy_available:
+        return _numpy_distance_map(blocked, width, height, goals, costs, diagonal)
+    return _python_distance_map(blocked, width, height, goals, costs, diagonal)
+
+def _numpy_distance_map(blocked, width, height, goals, costs, diagonal):
+    #a wavefront: every tile that got closer last round offers its distance to all its
+    #neighbours at once, until no tile gets closer. the grid has a border of blocked
+    #tiles, so the neighbours of a tile are at fixed offsets
+    row = width + 2
+    step = numpy.empty((height + 2, row))
+    step.fill(UNREACHABLE)
+    inner = step[1:-1, 1:-1]
+    inner[...] = 1.0 if costs is None else numpy.asarray(costs, dtype=float).reshape(height, width)
+    inner[numpy.asarray(blocked, dtype=bool).reshape(height, width)] = UNREACHABLE
+    step = step.ravel()
+
+    offsets = numpy.array([dy * row + dx for dx, dy, factor in STEPS] + [-row - 1, -row + 1, row - 1, row + 1])
+    factors = numpy.array([factor for dx, dy, factor in STEPS] + [diagonal] * 4)
+    distances = numpy.empty(step.size)
+    distances.fill(UNREACHABLE)
+    frontier = numpy.array([(y + 1) * row + x + 1 for x, y in goals], dtype=numpy.intp)
+    distances[frontier] = 0.0
+
+    while frontier.size:
+        neighbours = (frontier[:, None] + offsets).ravel()
+        offered = (distances[frontier][:, None] + factors * step[neighbours].reshape(-1, len(offsets))).ravel()
+        closer = offered < distances[neighbours]
+        neighbours = neighbours[closer]
+        numpy.minimum.at(distances, neighbours, offered[closer])
+        frontier = numpy.unique(neighbours)
+    return distances.reshape(height + 2, row)[1:-1, 1:-1].ravel()
+
+def _python_distance_map(blocked, width, height, goals, costs, diagonal):
+    #plain dijkstra with a heap
+    distances = [UNREACHABLE] * (width * height)
+    heap = []
+    for x, y in goals:
+        distances[y * width + x] = 0.0
+        heap.append((0.0, x, y))
+    heapq.heapify(heap)
+    steps = STEPS + [(dx, dy, diagonal) for dx in (-1, 1) for dy in (-1, 1)]
+
+    while heap:
+        distance, x, y = heapq.heappop(heap)
+        if distance > distances[y * width + x]:
+            continue  #already reached by a shorter way
+        for dx, dy, factor in steps:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < width and 0 <= ny < height:
+                i = ny * width + nx
+                if blocked[i]:
+                    continue
+                new = distance + (factor if costs is None else factor * costs[i])
+                if new < distances[i]:
+                    distances[i] = new
+                    heapq.heappush(heap, (new, nx, ny))
+    return distances
@@ -1,8 +1,26 @@
 import libtcodpy as libtcod
+import flowfield
+import os
+import mmap
+import shutil
+import tempfile
+import collections
+import atexit
 import math
 import textwrap
-import shelve
+import struct
 import time
+import heapq
+import itertools
+import bisect
+import cPickle
+import threading
+
+try:  #import NumPy if available
+    import numpy
+    numpy_available = True
+except ImportError:
+    numpy_available = False
 
 #Console Variables
 SCREEN_WIDTH = 80
@@ -18,6 +36,36 @@ ROOM_MAX_SIZE = 15
 ROOM_MIN_SIZE = 8
 MAX_ROOMS = 30
 
+#game time: an action takes TURN_TIME * NORMAL_SPEED / speed, so a fighter twice as fast
+#as normal acts twice in a turn
+TURN_TIME = 100
+NORMAL_SPEED = 100
+
+#sleeping monsters wake up when they come into view, hear a fight within NOISE_RADIUS
+#tiles, or when the player comes within WAKE_DISTANCE tiles. out of view, awake monsters
+#follow the player if it is no more than HEARING_DISTANCE tiles away, walking
+WAKE_DISTANCE = 2
+NOISE_RADIUS = 6
+HEARING_DISTANCE = 8
+
+#travel commands: key, kind of goal, and what to say when there is no way to a goal
+TRAVEL_KEYS = {'x': 'explore', 't': 'stairs', 'p': 'item'}
+TRAVEL_NOWHERE = {'explore': 'There is nothing left to explore.',
+                  'stairs': "You don't know the way to the stairs.",
+                  'item': "You don't know of any item you can reach."}
+#while travelling, the screen is drawn every this many steps
+TRAVEL_RENDER_STEPS = 8
+
+#monster and item definitions, read from these files in CFG_FOLDER (see load_definitions)
+CFG_FOLDER = os.path.join('data', 'cfg')
+MONSTERS_FILE = 'monsters.cfg'
+ITEMS_FILE = 'items.cfg'
+DEFINITIONS_CACHE = os.path.join(CFG_FOLDER, 'definitions.cache')
+DEFINITIONS_VERSION = 1
+
+#steps to the eight neighbouring tiles
+NEIGHBOURS = [(0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (1, -1), (-1, 1), (1, 1)]
+
 #fog
 FOV_ALGO = 0
 FOV_LIGHT_WALLS = True
@@ -27,14 +75,21 @@ TORCH_RADIUS = 10
 LEVEL_UP_BASE = 500
 LEVEL_UP_FACTOR = 250
 
-HEAL_AMOUNT = 10
-RESTORE_AMOUNT = 30
 LIGHTNING_DAMAGE = 20
 LIGHTNING_RANGE = 5
 CONFUSED_NUM_TURNS = 5
 CONFUSE_RANGE = 8
 FIREBALL_RADIUS = 3
 FIREBALL_DAMAGE = 10
+#how long spell effects stay on the map, in milliseconds
+EFFECT_MILLI = 300
+
+#how many visited levels stay in memory, the others go to disk
+LEVEL_CACHE_SIZE = 5
+
+#random streams, besides one per dungeon level (see stream_seed)
+LOOT_STREAM = -1
+COMBAT_STREAM = -2
 
 #colors
 color_dark_wall = libtcod.Color(139, 131, 120)
@@ -42,6 +97,11 @@ color_light_wall = libtcod.Color(205, 192, 176)
 color_dark_ground = libtcod.Color(184, 134, 11)
 color_light_ground = libtcod.Color(218, 165, 32)
 
+#tile background for each tile code (see render_tiles)
+TILE_COLORS = [libtcod.black, color_dark_ground, color_dark_wall, color_light_ground, color_light_wall]
+if numpy_available:
+    tile_palette = numpy.array([(c.r, c.g, c.b) for c in TILE_COLORS], dtype=numpy.uint8)
+
 #gui
 BAR_WIDTH = 20
 PANEL_HEIGHT = 7
@@ -53,18 +113,94 @@ INVENTORY_WIDTH = 50
 LEVEL_SCREEN_WIDTH = 40
 CHARACTER_SCREEN_WIDTH = 30
 
-class Tile:
+def new_layer(size, value):
+    #a flat array of flags, one per tile: NumPy bools if available, bytes otherwise
+    if numpy_available:
+        layer = numpy.empty(size, dtype=bool)
+        layer.fill(value)
+        return layer
+    return bytearray(b'\x01' if value else b'\x00') * size
+
+def fill_layer(layer, where, value):
+    #set a slice of a layer to a single value
+    if isinstance(layer, bytearray):
+        layer[where] = (b'\x01' if value else b'\x00') * len(xrange(*where.indices(len(layer))))
+    else:
+        layer[where] = value
+
+class Map(object):
+    """
+    the tiles of a level, stored as flat layers of flags (row by row, one entry per tile).
+    map[x][y] gives a Tile view, so map[x][y].blocked still works
+    """
+    def __init__(self, width, height, blocked = True, layers = None):
+        self.width = width
+        self.height = height
+        if layers:
+            #existing layers (from a savegame)
+            self.blocked, self.block_sight, self.explored = layers
+            return
+        #by default, if a tile is blocked, it also blocks sight
+        self.blocked = new_layer(width * height, blocked)
+        self.block_sight = new_layer(width * height, blocked)
+        self.explored = new_layer(width * height, False)
+
+    def own_layers(self):
+        #copy the layers that are views into other memory (a loaded savegame)
+        if numpy_available:
+            for name in ('blocked', 'block_sight', 'explored'):
+                layer = getattr(self, name)
+                if layer.base is not None:
+                    setattr(self, name, layer.copy())
+
+    def __getitem__(self, x):
+        return Column(self, x)
+
+    def carve(self, x1, y1, x2, y2):
+        #make the tiles from (x1, y1) up to (but not including) (x2, y2) passable
+        if x2 - x1 == 1:
+            #a single column, one strided slice
+            rows = [slice(y1 * self.width + x1, (y2 - 1) * self.width + x1 + 1, self.width)]
+        else:
+            rows = [slice(y * self.width + x1, y * self.width + x2) for y in range(y1, y2)]
+        for row in rows:
+            fill_layer(self.blocked, row, False)
+            fill_layer(self.block_sight, row, False)
+
+class Column(object):
+    """
+    a column of the map, so tiles can be accessed as map[x][y]
+    """
+    __slots__ = ('map', 'x')
+
+    def __init__(self, map, x):
+        self.map = map
+        self.x = x
+
+    def __getitem__(self, y):
+        return Tile(self.map, y * self.map.width + self.x)
+
+def tile_flag(layer_name):
+    #a property reading and writing one tile's entry in a layer of the map
+    def get(self):
+        return bool(getattr(self.map, layer_name)[self.i])
+    def set(self, value):
+        getattr(self.map, layer_name)[self.i] = bool(value)
+    return property(get, set)
+
+class Tile(object):
     """
-    a tile of the map and its properties
+    a tile of the map and its properties, a view into the map's layers
     """
-    def __init__(self, blocked, block_sight = None):
-        self.explored = False
-        self.blocked = blocked
+    __slots__ = ('map', 'i')
 
-        #By default, if a tile is blocked, it also blocks sight
-        if block_sight is None:
-            block_sight = blocked
-        self.block_sight = block_sight
+    def __init__(self, map, i):
+        self.map = map
+        self.i = i
+
+    blocked = tile_flag('blocked')
+    block_sight = tile_flag('block_sight')
+    explored = tile_flag('explored')
 
 class Rect:
     """
@@ -117,8 +253,18 @@ class Object:
     def move(self, dx, dy):
         #move by the given amount
         if not is_blocked(self.x + dx, self.y + dy):
-            self.x += dx
-            self.y += dy
+            self.place(self.x + dx, self.y + dy)
+
+    def place(self, x, y):
+        #set the position, keeping the tile index in sync if this object is on the map
+        mark_dirty(self)
+        bucket = object_index.get((self.x, self.y))
+        if bucket is not None and self in bucket:
+            unindex_object(self)
+            self.x, self.y = x, y
+            index_object(self)
+        else:
+            self.x, self.y = x, y
 
     def move_towards(self, target_x, target_y):
         #vector from this object to the target, and distance
@@ -132,6 +278,27 @@ class Object:
         dy = int(round(dy / distance))
         self.move(dx, dy)
 
+    def downhill_step(self, distances):
+        #the step to the free neighbouring tile that is closest to the root of a distance map
+        #(see player_distances), or None if no free tile is closer than this one
+        best = distances[self.y * MAP_WIDTH + self.x]
+        step = None
+        for dx, dy in NEIGHBOURS:
+            x, y = self.x + dx, self.y + dy
+            if 0 <= x < MAP_WIDTH and 0 <= y < MAP_HEIGHT:
+                d = distances[y * MAP_WIDTH + x]
+                if d < best and not is_blocked(x, y):
+                    best, step = d, (dx, dy)
+        return step
+
+    def move_downhill(self, distances):
+        #take the downhill step, if any. returns false if there is none
+        step = self.downhill_step(distances)
+        if step is None:
+            return False
+        self.place(self.x + step[0], self.y + step[1])
+        return True
+
     def distance_to(self, other):
         #return the distance to another object
         dx = other.x - self.x
@@ -142,24 +309,19 @@ class Object:
         #return this distance to some coordinates
         return math.sqrt((x - self.x) ** 2 + (y - self.y) ** 2)
 
-    def draw(self):
-        #set the color and then draw the character that represents this object at its position
-        if libtcod.map_is_in_fov(fov_map, self.x, self.y) or (self.always_visible and map[self.x][self.y].explored):
-            libtcod.console_set_default_foreground(con, self.color)
-            libtcod.console_put_char(con, self.x, self.y, self.char, libtcod.BKGND_NONE)
-
-    def clear(self):
-        #erase the character that represents this object
-        libtcod.console_put_char(con, self.x, self.y, ' ', libtcod.BKGND_NONE)
     def send_to_back(self):
         #make this object be drawn first, so all others appear above it if they're in the same tile.
         global objects
         objects.remove(self)
         objects.insert(0, self)
+        objects_changed()
+        bucket = object_index[(self.x, self.y)]
+        bucket.remove(self)
+        bucket.insert(0, self)
 
 class Fighter:
     def __init__(self, hp, defense, power, xp, mana = None, death_function=None, boss=False,
-                helmet = False, torso = False, leggings = False, boots = False, weapon = False):
+                helmet = False, torso = False, leggings = False, boots = False, weapon = False, speed = NORMAL_SPEED):
         self.max_hp = hp
         self.hp = hp
         self.defense = defense
@@ -171,9 +333,12 @@ class Fighter:
         self.mana = mana
         self.helmet, self.torso, self.leggings, self.boots = helmet, torso, leggings, boots
         self.weapon = weapon
+        self.speed = speed
+        self.next_time = 0 #game time of the next action, while awake (see take_monster_turns)
 
     def take_damage(self, damage):
         #apply damage if possible
+        mark_dirty(self.owner)
         if damage > 0:
             self.hp -= damage
         if self.hp <= 0:
@@ -181,6 +346,7 @@ class Fighter:
             if function is not None:
                 function(self.owner)
             if self.owner != player: #yield xp
+                mark_dirty(player)
                 player.fighter.xp += self.xp
 
     def attack(self, target):
@@ -196,11 +362,13 @@ class Fighter:
 
     def heal(self, amount):
         #heal by the given amount, without going over the maximum
+        mark_dirty(self.owner)
         self.hp += amount
         if self.hp > self.max_hp:
             self.hp = self.max_hp
 
     def restore(self, amount):
+        mark_dirty(self.owner)
         self.mana += amount
         if self.mana > self.max_mana:
             self.mana = self.max_mana
@@ -252,35 +420,39 @@ def The_last_stand():
         player.fighter.hp = 1
 
 class BasicMonster:
-    #AI for a basic monster
+    #AI for a basic monster. awake is 0 while it sleeps, else its place in the turn order (see wake)
+    def __init__(self, awake = 0):
+        self.awake = awake
+
     def take_turn(self):
         #a basic monster takes its turn. If you can see it, it can see you
         monster = self.owner
-        if libtcod.map_is_in_fov(fov_map, monster.x, monster.y):
-            #move towards player if far away
+        if in_fov(monster.x, monster.y):
+            #move towards player if far away, around walls if there is a way
             if monster.distance_to(player) >= 2:
-                monster.move_towards(player.x, player.y)
+                if not monster.move_downhill(player_distances()):
+                    monster.move_towards(player.x, player.y)
 
             #close enough, attack! (if the player is still alive.)
             elif player.fighter.hp > 0:
                 monster.fighter.attack(player)
+        else:
+            #out of sight: follow the player while close enough, or go back to sleep
+            distances = player_distances()
+            if distances[monster.y * MAP_WIDTH + monster.x] > HEARING_DISTANCE * 100: #in hundredths of a tile
+                fall_asleep(monster)
+            else:
+                monster.move_downhill(distances)
 
 class ConfusedMonster:
-     #AI for a confused monster
-    def __init__(self, old_ai, num_turns = CONFUSED_NUM_TURNS):
+    #AI for a confused monster, until the game time ends (see end_confusion)
+    def __init__(self, old_ai, ends):
         self.old_ai = old_ai
-        self.num_turns = num_turns
+        self.ends = ends
 
     def take_turn(self):
-
-        if self.num_turns > 0:
-            #move in a random direction
-            self.owner.move(libtcod.random_get_int(0, -1, 1), libtcod.random_get_int(0, -1, 1))
-            self.num_turns -= 1
-
-        else: #restore
-            self.owner.ai = self.old_ai
-            message('The ' + self.owner.name + ' is no longer confused!', libtcod.red)
+        #move in a random direction
+        self.owner.move(stream_int(COMBAT_STREAM, -1, 1), stream_int(COMBAT_STREAM, -1, 1))
 
 class Item:
     #an item that can be picked up and used
@@ -295,7 +467,7 @@ class Item:
             message('Your inventory is full, cannot pick up ' + self.owner.name + '.', libtcod.red)
         else:
             inventory.append(self.owner)
-            objects.remove(self.owner)
+            remove_object(self.owner)
             message('You picked up a ' + self.owner.name + '!', libtcod.green)
 
     def use(self):
@@ -308,10 +480,10 @@ class Item:
 
     def drop(self):
         #add to the map and remove from the player's inventory and place at player's coordinates
-        objects.append(self.owner)
         inventory.remove(self.owner)
         self.owner.x = player.x
         self.owner.y = player.y
+        add_object(self.owner)
         message('You dropped a ' + self.owner.name + '.', libtcod.yellow)
 
 class Equipment:
@@ -328,7 +500,7 @@ class Equipment:
         else:
             equipment.append(self.owner)
             self.user = player
-            objects.remove(self.owner)
+            remove_object(self.owner)
             message('You picked up a ' + self.owner.name + '!', libtcod.green)
 
     def equip(self):
@@ -381,68 +553,202 @@ class Equipment:
 
     def drop(self):
         #add to the map and remove from the player's inventory and place at player's coordinates
-        objects.append(self.owner)
         equipment.remove(self.owner)
         self.owner.x = player.x
         self.owner.y = player.y
+        add_object(self.owner)
         message('You dropped a ' + self.owner.name + '.', libtcod.yellow)
 
-def create_room(room):
-    global map
+class Level:
+    """
+    a dungeon level: its map, its objects and where the player starts. generating one
+    doesn't touch the game's globals, so it can be done in a worker thread
+    """
+    def __init__(self, dungeon_level, map = None):
+        self.dungeon_level = dungeon_level
+        self.map = map if map is not None else Map(MAP_WIDTH, MAP_HEIGHT)
+        self.objects = []
+        self.object_index = {}
+        self.stairs = None
+        self.up_stairs = None
+        self.boss = False
+        self.start = None
+        #false until the level is written to the level store's directory
+        self.saved = False
+
+    def add(self, obj):
+        self.objects.append(obj)
+        self.object_index.setdefault((obj.x, obj.y), []).append(obj)
+
+    def send_to_back(self, obj):
+        self.objects.remove(obj)
+        self.objects.insert(0, obj)
+
+    def is_blocked(self, x, y):
+        #like is_blocked, with the player standing on the start tile
+        if self.map.blocked[y * self.map.width + x] or (x, y) == self.start:
+            return True
+        for object in self.object_index.get((x, y), ()):
+            if object.blocks:
+                return True
+        return False
+
+class LevelJob(threading.Thread):
+    """
+    generates a level in a worker thread, see pregenerate_next_level
+    """
+    def __init__(self, seed, dungeon_level, player_level):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.key = (seed, dungeon_level, player_level)
+        self.level = None
+
+    def run(self):
+        self.level = generate_level(*self.key)
+
+def create_room(map, room):
     #go through the tiles in the rectangle and make them passable
-    for x in range(room.x1 + 1, room.x2):
-        for y in range(room.y1 + 1, room.y2):
-            map[x][y].blocked = False
-            map[x][y].block_sight = False
+    map.carve(room.x1 + 1, room.y1 + 1, room.x2, room.y2)
 
-def create_h_tunnel(x1, x2, y):
-    global map
+def create_h_tunnel(map, x1, x2, y):
     #horizontal tunnel
-    for x in range(min(x1, x2), max(x1, x2) + 1):
-        map[x][y].blocked = False
-        map[x][y].block_sight = False
+    map.carve(min(x1, x2), y, max(x1, x2) + 1, y + 1)
 
-def create_v_tunnel(y1, y2, x):
-    global map
+def create_v_tunnel(map, y1, y2, x):
     #vertical tunnel
-    for y in range(min(y1, y2), max(y1, y2) + 1):
-        map[x][y].blocked = False
-        map[x][y].block_sight = False
+    map.carve(x, min(y1, y2), x + 1, max(y1, y2) + 1)
 
-def make_map():
-    global map, objects, stairs, boss
+class LevelStore:
+    """
+    the levels the player has left: the LEVEL_CACHE_SIZE most recently left stay in memory,
+    the others are written to a directory in the savegame format and read back when visited.
+    a level doesn't change while the player is away, so it is written at most once per visit
+    """
+    def __init__(self):
+        self.directory = None
+        self.reset()
+
+    def reset(self, directory = None):
+        #forget every level, then use the levels already in directory (if any)
+        if self.directory and self.temporary:
+            shutil.rmtree(self.directory, ignore_errors = True)
+        self.cache = collections.OrderedDict()  #dungeon level -> Level, least recently left first
+        self.directory = directory
+        self.temporary = False
+        self.on_disk = set()
+        if directory and os.path.isdir(directory):
+            self.on_disk = set(int(name) for name in os.listdir(directory) if name.isdigit())
+
+    def __contains__(self, dungeon_level):
+        return dungeon_level in self.cache or dungeon_level in self.on_disk
+
+    def put(self, level):
+        level.saved = False
+        self.cache[level.dungeon_level] = level
+        while len(self.cache) > LEVEL_CACHE_SIZE:
+            dungeon_level, old = self.cache.popitem(last = False)
+            if not old.saved:
+                self.write(old)
+
+    def take(self, dungeon_level):
+        #a visited level, or None
+        if dungeon_level in self.cache:
+            return self.cache.pop(dungeon_level)
+        if dungeon_level in self.on_disk:
+            with open(self.path(dungeon_level), 'rb') as file:
+                return read_level(SaveReader(mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_COPY), LEVEL_MAGIC), dungeon_level)
+        return None
 
-    #list of objects with just player
-    objects = [player, ]
-    #fill map with walls
-    map = [[ Tile(True) for y in range(MAP_HEIGHT) ] for x in range(MAP_WIDTH) ]
+    def path(self, dungeon_level):
+        return os.path.join(self.directory, str(dungeon_level))
+
+    def write(self, level):
+        if self.directory is None:
+            #not saved yet, spill to a temporary directory
+            self.directory = tempfile.mkdtemp(prefix = 'rouge-levels-')
+            self.temporary = True
+        level.map.own_layers()
+        with open(self.path(level.dungeon_level), 'wb') as file:
+            file.write(write_level(level))
+        self.on_disk.add(level.dungeon_level)
+        level.saved = True
+
+    def save(self, directory):
+        #make directory hold every stored level, next to a savegame
+        if directory != self.directory:
+            if os.path.isdir(directory):
+                shutil.rmtree(directory)
+            os.makedirs(directory)
+            for dungeon_level in self.on_disk:
+                shutil.move(self.path(dungeon_level), os.path.join(directory, str(dungeon_level)))
+            if self.temporary:
+                shutil.rmtree(self.directory, ignore_errors = True)
+            self.directory = directory
+            self.temporary = False
+        for level in self.cache.values():
+            if not level.saved:
+                self.write(level)
+
+def make_map():
+    #generate the current dungeon level and enter it
+    enter_level(generate_level(world_seed, dungeon_level, player.level))
+
+def enter_level(level):
+    #make a level the current one, with the player at its start
+    global map, objects, object_index, stairs, up_stairs, boss
+    map = level.map
+    objects = level.objects
+    object_index = level.object_index
+    stairs = level.stairs
+    up_stairs = level.up_stairs
+    boss = level.boss
+    player.x, player.y = level.start
+    add_object(player)
+    index_monsters()
+
+def leave_level():
+    #put the current level, without the player, in the level store
+    remove_object(player)
+    level = Level(dungeon_level, map)
+    level.objects = objects
+    level.object_index = object_index
+    level.stairs = stairs
+    level.up_stairs = up_stairs
+    level.boss = boss
+    level_store.put(level)
+
+def generate_level(seed, dungeon_level, player_level):
+    #every level has its own random stream, so the same world seed always gives the same level
+    rnd = libtcod.random_new_from_seed(stream_seed(seed, dungeon_level))
+    level = Level(dungeon_level)
+    map = level.map
 
     rooms = []
     num_rooms = 0
 
     #boss time
     if dungeon_level % 10 == 0:
-        boss = True
+        level.boss = True
         first_room = Rect(1, 1, MAP_WIDTH / 5, MAP_HEIGHT - 2)
         second_room = Rect(MAP_WIDTH / 2, 1, MAP_WIDTH / 2 - 1, MAP_HEIGHT - 2)
-        create_room(first_room)
-        create_room(second_room)
+        create_room(map, first_room)
+        create_room(map, second_room)
         rooms.append(first_room)
         rooms.append(second_room)
-        player.x, player.y = first_room.center()
+        level.start = first_room.center()
         new_x, new_y = second_room.center()
-        create_h_tunnel(player.x, new_x, player.y)
-        place_objects(second_room)
+        create_h_tunnel(map, level.start[0], new_x, level.start[1])
+        place_objects(level, second_room, rnd, player_level)
         num_rooms = 2
     else:
         for r in range(MAX_ROOMS):
             #random width and height
-            w = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-            h = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+            w = libtcod.random_get_int(rnd, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+            h = libtcod.random_get_int(rnd, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
 
             #random position without going out of the boundaries of the map
-            x = libtcod.random_get_int(0, 0, MAP_WIDTH - w - 1)
-            y = libtcod.random_get_int(0, 0, MAP_HEIGHT - h - 1)
+            x = libtcod.random_get_int(rnd, 0, MAP_WIDTH - w - 1)
+            y = libtcod.random_get_int(rnd, 0, MAP_HEIGHT - h - 1)
 
             new_room = Rect(x, y, w, h)
 
@@ -457,15 +763,14 @@ def make_map():
                 #this means there are no intersections, so this room is valid
 
                 #"paint" it to the map's tiles
-                create_room(new_room)
+                create_room(map, new_room)
 
                 #center coordinates of new room
                 new_x, new_y = new_room.center()
 
                 if num_rooms == 0:
                     #this is the first room, where the player starts at
-                    player.x = new_x
-                    player.y = new_y
+                    level.start = (new_x, new_y)
                 else:
                     #all rooms after the first
                     #connect it to the previous room with a tunnel
@@ -474,358 +779,485 @@ def make_map():
                     prev_x, prev_y = rooms[num_rooms - 1].center()
 
                     #random number that is either 0 or 1
-                    if libtcod.random_get_int(0, 0, 1) == 1:
+                    if libtcod.random_get_int(rnd, 0, 1) == 1:
                         #first move horizontally, then vertically
-                        create_h_tunnel(prev_x, new_x, prev_y)
-                        create_v_tunnel(prev_y, new_y, new_x)
+                        create_h_tunnel(map, prev_x, new_x, prev_y)
+                        create_v_tunnel(map, prev_y, new_y, new_x)
                     else:
                         #first move vertically, then horizontally
-                        create_v_tunnel(prev_y, new_y, prev_x)
-                        create_h_tunnel(prev_x, new_x, new_y)
+                        create_v_tunnel(map, prev_y, new_y, prev_x)
+                        create_h_tunnel(map, prev_x, new_x, new_y)
 
                 #finally, append the new room to the list
                 rooms.append(new_room)
 
                 #populate
-                place_objects(new_room)
+                place_objects(level, new_room, rnd, player_level)
                 num_rooms += 1
         #boss/miniboss handling
-        boss = False
         if dungeon_level % 5 == 0 and dungeon_level % 10 != 0:
-            boss = True
+            level.boss = True
             #create miniboss
-            fighter_component = Fighter(hp = 25, defense = 2, power = 6, xp = 200, death_function = monster_death, boss = boss)
-            ai_component = BasicMonster()
-            monster = Object(new_x, new_y, 'm', 'miniboss', libtcod.red, blocks = True, fighter = fighter_component, ai = ai_component)
-            objects.append(monster)
-        elif dungeon_level % 10 == 0:
-            boss = True
-            #create da boss
+            monster = BOSS_TYPES['miniboss'].create(new_x, new_y, boss = True)
+            level.add(monster)
         #create stairs at the center of the last room
-    stairs = Object(new_x, new_y, '<', 'stairs', libtcod.white, always_visible = True)
-    objects.append(stairs)
-
-
-def place_objects(room):
-    global player, dungeon_level
+    level.stairs = Object(new_x, new_y, '<', 'stairs', libtcod.white, always_visible = True)
+    level.add(level.stairs)
+    if dungeon_level > 1:
+        #stairs back up where the player arrives
+        level.up_stairs = Object(level.start[0], level.start[1], '>', 'up stairs', libtcod.white, always_visible = True)
+        level.add(level.up_stairs)
+    libtcod.random_delete(rnd)
+    return level
+
+def place_objects(level, room, rnd, player_level):
+    dungeon_level = level.dungeon_level
     if dungeon_level % 10 == 0:
         #create boss
         cx, cy = room.center()
-        fighter_component = Fighter(hp = 100, defense = 5, power = 8, xp = 3000, death_function = monster_death, boss = boss)
-        ai_component = BasicMonster()
-        monster = Object(cx, cy, 'B', 'boss', libtcod.dark_red, blocks = True, fighter = fighter_component, ai = ai_component)
-        objects.append(monster)
+        monster = BOSS_TYPES['boss'].create(cx, cy, boss = level.boss)
+        level.add(monster)
     #choose random number of monsters
     max_monsters = int(math.floor(math.sqrt(dungeon_level)))
-    num_monsters = libtcod.random_get_int(0, 0, max_monsters + 1)
+    num_monsters = libtcod.random_get_int(rnd, 0, max_monsters + 1)
 
     for i in range(num_monsters):
         #choose random spot for this monster
-        x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-        y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
-
-        if not is_blocked(x, y):
-            dice = libtcod.random_get_int(0, 0, 100)
-            rarity = libtcod.random_get_int(0, 0, 100)
-            equip = libtcod.random_get_int(0, 0, 100)
-            if  dice < (51 - player.level * 1 - dungeon_level * .5): #80% chance of getting an orc
-                #create spider
-                fighter_component = Fighter(hp = 10, defense = 0, power = 1, xp = 100, death_function = monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 's', 'spider', libtcod.desaturated_red, blocks = True, fighter = fighter_component, ai = ai_component)
-                if rarity > 75:
-                    monster.color = libtcod.red
-                elif rarity > 95:
-                    monster.color = libtcod.darker_red
-            elif dice < (71 - player.level * .75 - dungeon_level * .3):
-                #create a wolf
-                fighter_component = Fighter(hp = 15, defense = 1, power = 2, xp = 125, death_function = monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 'w', 'wolf', libtcod.desaturated_green, blocks = True, fighter = fighter_component, ai = ai_component)
-                if rarity > 75:
-                    monster.color = libtcod.green
-                if rarity > 95:
-                    monster.color = libtcod.darker_green
-            elif dice < (81 - player.level * .5 - dungeon_level * .25):
-                #create a bandit
-                fighter_component = Fighter(hp = 20, defense = 1, power = 3, xp = 175, death_function = monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 'b', 'bandit', libtcod.desaturated_blue, blocks = True, fighter = fighter_component, ai = ai_component)
-                if rarity > 75:
-                    monster.color = libtcod.blue
-                if rarity > 95:
-                    monster.color = libtcod.darker_blue
-            elif dice < (86 - player.level * .4 - dungeon_level * .2):
-                #create a skeleton
-                fighter_component = Fighter(hp = 20, defense = 3, power = 4, xp = 250, death_function = monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 'S', 'skeleton', libtcod.desaturated_sea, blocks = True, fighter = fighter_component, ai = ai_component)
-                if rarity > 75:
-                    monster.color = libtcod.sea
-                if rarity > 95:
-                    monster.color = libtcod.darker_sea
-            elif dice < (91 - player.level * .4 - dungeon_level * .2):
-                #create a orc
-                fighter_component = Fighter(hp = 40, defense = 3, power = 5, xp = 350, death_function = monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 'o', 'orc', libtcod.desaturated_azure, blocks = True, fighter = fighter_component, ai = ai_component)
-                if rarity > 75:
-                    monster.color = libtcod.azure
-                if rarity > 95:
-                    monster.color = libtcod.darker_azure
-            elif dice < (94 - player.level * .3 - dungeon_level * .15):
-                #create a vampire
-                fighter_component = Fighter(hp = 30, defense = 5, power = 6, xp = 500, death_function = monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 'V', 'vampire', libtcod.darker_red, blocks = True, fighter = fighter_component, ai = ai_component)
-                if rarity > 75:
-                    monster.color = libtcod.darker_flame
-                if rarity > 95:
-                    monster.color = libtcod.darker_crimson
-            elif dice < (97 - player.level * .3 - dungeon_level * .15):
-                #create a werewolf
-                fighter_component = Fighter(hp = 60, defense = 8, power = 5, xp = 750, death_function = monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 'W', 'werewolf', libtcod.darker_azure, blocks = True, fighter = fighter_component, ai = ai_component)
-                if rarity > 75:
-                    monster.color = libtcod.darker_sea
-                if rarity > 95:
-                    monster.color = libtcod.darker_blue
-            elif dice < (99 - player.level * .2 - dungeon_level * .1):
-                #create a troll
-                fighter_component = Fighter(hp = 80, defense = 8, power = 6, xp = 1100, death_function = monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 'T', 'troll', libtcod.darker_green, blocks = True, fighter = fighter_component, ai = ai_component)
-                if rarity > 75:
-                    monster.color = libtcod.darker_lime
-                if rarity > 95:
-                    monster.color = libtcod.darker_chartreuse
-            elif dice < (100 - player.level * .1 - dungeon_level * .05):
-                #create a mammoth
-                fighter_component = Fighter(hp = 100, defense = 10, power = 6, xp = 1500, death_function = monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 'M', 'mammoth', libtcod.black, blocks = True, fighter = fighter_component, ai = ai_component)
-                if rarity > 75:
-                    monster.color = libtcod.gray
-                if rarity > 95:
-                    monster.color = libtcod.darker_gray
-            elif dice < (101 - player.level * .01 - dungeon_level * .01):
-                #create a giant
-                fighter_component = Fighter(hp = 150, defense = 10, power = 10, xp = 2500, death_function = monster_death)
-                ai_component = BasicMonster()
-                monster = Object(x, y, 'G', 'giant', libtcod.pink, blocks = True, fighter = fighter_component, ai = ai_component)
-                if rarity > 75:
-                    monster.color = libtcod.purple
-                if rarity > 95:
-                    monster.color = libtcod.darker_pink
-            if rarity <= 75:
-                monster.name = 'weak ' + monster.name
-            elif rarity > 75 and rarity <= 95:
-                monster.fighter.hp = monster.fighter.hp * 5 / 4
-                monster.fighter.defense = monster.fighter.defense * 5 / 4
-                monster.fighter.power = monster.fighter.power * 5 / 4
-                monster.fighter.xp = monster.fighter.xp * 5 / 4
-            elif rarity > 95:
-                monster.fighter.hp = monster.fighter.hp * 2
-                monster.fighter.defense = monster.fighter.defense * 2
-                monster.fighter.power = monster.fighter.power * 2
-                monster.fighter.xp = monster.fighter.xp * 2
-                monster.name = 'elite ' + monster.name
-            monster.fighter.hp *= 1.013 ** (player.level + dungeon_level) + (player.level + dungeon_level) // 2.1
-            monster.fighter.defense *= 1.013 ** (player.level + dungeon_level) + (player.level + dungeon_level) // 1.3
-            monster.fighter.power *= 1.013 ** (player.level + dungeon_level) + (player.level + dungeon_level) // 4.4
-            monster.fighter.xp *= 1.013 ** (player.level + dungeon_level)
-            if equip > 80 and equip <= 84:
-                #helmet
-                equip_component = Equipment('helmet', 1, monster)
-                monster.equip = Object(x,y, 'U', 'helmet',libtcod.sepia, equip = equip_component)
-            elif equip > 84 and equip <= 88:
-                #torso
-                equip_component = Equipment('torso', 1, monster)
-                monster.equip = Object(x, y, 'T', 'torso', libtcod.sepia, equip = equip_component)
-            elif equip > 88 and equip <= 92:
-                #leggings
-                equip_component = Equipment('leggings', 1, monster)
-                monster.equip = Object(x, y, 'M', 'leggings', libtcod.sepia, equip = equip_component)
-            elif equip > 92 and equip <= 96:
-                #boots
-                equip_component = Equipment('boots', 1, monster)
-                monster.equip = Object(x, y, 'b', 'boots', libtcod.sepia, equip = equip_component)
-            elif equip > 96:
-                #weapon
-                equip_component = Equipment('weapon', 3, monster)
-                monster.equip = Object(x, y, '/', 'weapon', libtcod.sepia, equip = equip_component)
-            objects.append(monster)
+        x = libtcod.random_get_int(rnd, room.x1 + 1, room.x2 - 1)
+        y = libtcod.random_get_int(rnd, room.y1 + 1, room.y2 - 1)
+
+        if not level.is_blocked(x, y):
+            dice = libtcod.random_get_int(rnd, 0, 100)
+            rarity = libtcod.random_get_int(rnd, 0, 100)
+            equip = libtcod.random_get_int(rnd, 0, 100)
+            #the first monster type whose threshold is above the dice
+            choice = bisect.bisect_right(spawn_table(dungeon_level, player_level), dice)
+            if choice == len(MONSTER_TYPES):
+                continue #deep down, the dice can miss every type
+            monster = MONSTER_TYPES[choice].create(x, y, rarity)
+            monster.fighter.hp *= 1.013 ** (player_level + dungeon_level) + (player_level + dungeon_level) // 2.1
+            monster.fighter.defense *= 1.013 ** (player_level + dungeon_level) + (player_level + dungeon_level) // 1.3
+            monster.fighter.power *= 1.013 ** (player_level + dungeon_level) + (player_level + dungeon_level) // 4.4
+            monster.fighter.xp *= 1.013 ** (player_level + dungeon_level)
+            drop = bisect.bisect_left(EQUIP_THRESHOLDS, equip)
+            if drop > 0:
+                part, char, stat = EQUIP_DROPS[drop - 1]
+                equip_component = Equipment(part, stat, monster)
+                monster.equip = Object(x, y, char, part, libtcod.sepia, equip = equip_component)
+            level.add(monster)
     #choose random number of items
     max_items = int(math.floor(math.sqrt(dungeon_level)))
-    num_items = libtcod.random_get_int(0, 0, max_items + 1)
+    num_items = libtcod.random_get_int(rnd, 0, max_items + 1)
 
     for i in range(num_items):
         #choose random spot for this item
-        x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-        y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
+        x = libtcod.random_get_int(rnd, room.x1 + 1, room.x2 - 1)
+        y = libtcod.random_get_int(rnd, room.y1 + 1, room.y2 - 1)
 
         #only place it if the tile is not blocked
-        if not is_blocked(x, y):
-            dice = libtcod.random_get_int(0, 0, 1000)
-            if dice < 100:
-                #create a healing potion
-                item_component = Item(use_function = cast_heal, strength=1)
-                item = Object(x, y, '!', 'healing potion I', libtcod.desaturated_pink, item = item_component)
-            elif dice < 150:
-                item_component = Item(use_function = cast_heal, strength=2)
-                item = Object(x, y, '!', 'healing potion II', libtcod.pink, item = item_component)
-            elif dice < 175:
-                item_component = Item(use_function = cast_heal, strength=3)
-                item = Object(x, y, '!', 'healing potion III', libtcod.darker_pink, item = item_component)
-            elif dice < 225:
-                item_component = Item(use_function = cast_heal, strength=4)
-                item = Object(x, y, '~', 'restoration potion I', libtcod.desaturated_violet, item = item_component)
-            elif dice < 250:
-                item_component = Item(use_function = cast_heal, strength=5)
-                item = Object(x, y, '~', 'restoration potion II', libtcod.violet, item = item_component)
-            elif dice < 260:
-                item_component = Item(use_function = cast_heal, strength=6)
-                item = Object(x, y, '~', 'restoration potion III', libtcod.darker_violet, item = item_component)
-            elif dice < 360:
-                item_component = Item(use_function = cast_restore, strength=1)
-                item = Object(x, y, '!', 'mana potion I', libtcod.desaturated_pink, item = item_component)
-            elif dice < 410:
-                item_component = Item(use_function = cast_restore, strength=2)
-                item = Object(x, y, '!', 'mana potion II', libtcod.pink, item = item_component)
-            elif dice < 435:
-                item_component = Item(use_function = cast_restore, strength=3)
-                item = Object(x, y, '!', 'mana potion III', libtcod.darker_pink, item = item_component)
-            elif dice < 460:
-                item_component = Item(use_function = cast_restore, strength=4)
-                item = Object(x, y, '~', 'magic potion I', libtcod.desaturated_violet, item = item_component)
-            elif dice < 475:
-                item_component = Item(use_function = cast_restore, strength=5)
-                item = Object(x, y, '~', 'magic potion II', libtcod.violet, item = item_component)
-            elif dice < 485:
-                item_component = Item(use_function = cast_restore, strength=6)
-                item = Object(x, y, '~', 'magic potion III', libtcod.darker_violet, item = item_component)
-            elif dice < 585:
-                #create a  lightning bolt scroll
-                item_component = Item(use_function = cast_lightning, strength=1)
-                item = Object(x, y, '#', 'scroll of lightning bolt I', libtcod.light_yellow, item = item_component)
-            elif dice < 635:
-                #create a  lightning bolt scroll
-                item_component = Item(use_function = cast_lightning, strength=2)
-                item = Object(x, y, '#', 'scroll of lightning bolt II', libtcod.light_yellow, item = item_component)
-            elif dice < 660:
-                #create a  lightning bolt scroll
-                item_component = Item(use_function = cast_lightning, strength=3)
-                item = Object(x, y, '#', 'scroll of lightning bolt III', libtcod.light_yellow, item = item_component)
-            elif dice < 670:
-                #create a  lightning bolt scroll
-                item_component = Item(use_function = cast_lightning, strength=4)
-                item = Object(x, y, '#', 'scroll of lightning bolt IV', libtcod.light_yellow, item = item_component)
-            elif dice < 675:
-                #create a  lightning bolt scroll
-                item_component = Item(use_function = cast_lightning, strength=5)
-                item = Object(x, y, '#', 'scroll of lightning bolt V', libtcod.light_yellow, item = item_component)
-            elif dice < 775:
-                #create a fireball scroll
-                item_component = Item(use_function = cast_fireball, strength=1)
-                item = Object(x, y, '#', 'scroll of fireball I', libtcod.light_yellow, item = item_component)
-            elif dice < 825:
-                #create a fireball scroll
-                item_component = Item(use_function = cast_fireball, strength=2)
-                item = Object(x, y, '#', 'scroll of fireball II', libtcod.light_yellow, item = item_component)
-            elif dice < 850:
-                #create a fireball scroll
-                item_component = Item(use_function = cast_fireball, strength=3)
-                item = Object(x, y, '#', 'scroll of fireball III', libtcod.light_yellow, item = item_component)
-            elif dice < 860:
-                #create a fireball scroll
-                item_component = Item(use_function = cast_fireball, strength=4)
-                item = Object(x, y, '#', 'scroll of fireball IV', libtcod.light_yellow, item = item_component)
-            elif dice < 865:
-                #create a fireball scroll
-                item_component = Item(use_function = cast_fireball, strength=5)
-                item = Object(x, y, '#', 'scroll of fireball V', libtcod.light_yellow, item = item_component)
+        if not level.is_blocked(x, y):
+            dice = libtcod.random_get_int(rnd, 0, 1000)
+            item = ITEM_TYPES[bisect.bisect_right(ITEM_THRESHOLDS, dice)].create(x, y)
+            level.add(item)
+            level.send_to_back(item)
+
+def recompute_fov():
+    #compute the FOV from the player's position and keep the whole result as a flat layer,
+    #so every in_fov check until the next recompute is a lookup instead of a ctypes call
+    global visible_tiles
+    libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
+    visible_tiles = libtcod.map_get_fov(fov_map)
+    wake_visible_monsters()
+
+def update_fov():
+    #recompute the FOV and mark every visible tile as explored
+    recompute_fov()
+    if numpy_available:
+        map.explored |= visible_tiles
+    else:
+        map.explored[:] = bytearray(e | v for e, v in zip(map.explored, visible_tiles))
+
+def player_distances():
+    #walking distance from the player to every tile, shared by all monsters chasing the player.
+    #the flood fill only runs again once the player stands on another tile
+    global distances, distances_origin
+    if distances_origin != (player.x, player.y):
+        libtcod.dijkstra_compute(path_map, player.x, player.y)
+        distances = libtcod.dijkstra_get_distances(path_map)
+        distances_origin = (player.x, player.y)
+    return distances
+
+def explored_count():
+    #how many tiles have been seen: it only grows, so it tells when exploring has new goals
+    if numpy_available:
+        return numpy.count_nonzero(map.explored)
+    return map.explored.count(b'\x01')
+
+def travel_goals(kind):
+    #the tiles a travel command heads for, among those the player has seen
+    if kind == 'explore':
+        #every floor tile not seen yet
+        if numpy_available:
+            unseen = numpy.flatnonzero(~(map.blocked | map.explored))
+        else:
+            unseen = [i for i in xrange(MAP_WIDTH * MAP_HEIGHT) if not map.blocked[i] and not map.explored[i]]
+        return [(i % MAP_WIDTH, i // MAP_WIDTH) for i in unseen]
+    if kind == 'stairs':
+        targets = [stairs]
+    else:
+        #items and equipment lying around, but not the ones the player stands on
+        targets = [obj for obj in objects if (obj.item or obj.equip) and (obj.x, obj.y) != (player.x, player.y)]
+    return [(obj.x, obj.y) for obj in targets if map.explored[obj.y * MAP_WIDTH + obj.x]]
+
+def travel_distances(kind):
+    #the distance map towards a travel command's goals, kept until the goals change
+    key = explored_count() if kind == 'explore' else travel_goals(kind)
+    cached = travel_maps.get(kind)
+    if cached is None or cached[0] != key:
+        goals = travel_goals(kind) if kind == 'explore' else key
+        cached = travel_maps[kind] = (key, flowfield.distance_map(map.blocked, MAP_WIDTH, MAP_HEIGHT, goals))
+    return cached[1]
+
+def start_travel(kind):
+    global travel_goal, travel_steps
+    travel_goal = kind
+    travel_steps = 0
+
+def stop_travel():
+    global travel_goal
+    travel_goal = None
+
+def travel_step():
+    #one turn of the current travel command: a step downhill on its distance map. travelling
+    #stops at the goal, when there is no way there, or when a monster comes into view
+    global travel_steps
+    if fov_recompute:
+        #the screen may not be drawn this turn, so update the FOV here. fov_recompute stays
+        #set: the next frame drawn must show the new tiles
+        update_fov()
+    for obj in active_monsters:
+        if in_fov(obj.x, obj.y):
+            if travel_steps > 0:
+                message('The ' + obj.name + ' comes into view.', libtcod.orange)
             else:
-                #create a confused scroll
-                item_component = Item(use_function = cast_confuse)
-                item = Object(x, y, '%', 'scroll of confusion', libtcod.light_yellow, item = item_component)
-            objects.append(item)
-            item.send_to_back()
+                message('Not with the ' + obj.name + ' in view!', libtcod.orange)
+            stop_travel()
+            return 'didnt-take-turn'
+
+    distances = travel_distances(travel_goal)
+    step = player.downhill_step(distances)
+    if step is None:
+        if distances[player.y * MAP_WIDTH + player.x] == flowfield.UNREACHABLE:
+            message(TRAVEL_NOWHERE[travel_goal], libtcod.light_gray)
+        stop_travel()
+        return 'didnt-take-turn'
+    player_move_or_attack(*step)
+    travel_steps += 1
+    if travel_goal == 'item' and any(obj.item or obj.equip for obj in objects_at(player.x, player.y)):
+        stop_travel()
+
+def in_fov(x, y):
+    #true if the tile was in the player's FOV at the last recompute
+    return 0 <= x < MAP_WIDTH and 0 <= y < MAP_HEIGHT and visible_tiles[y * MAP_WIDTH + x]
+
+def render_tiles(visible):
+    #fill the background of the whole map in one call. each tile gets a code into TILE_COLORS:
+    #0 if unexplored, else 1 + wall, plus 2 if visible
+    if numpy_available:
+        codes = numpy.zeros((SCREEN_HEIGHT, SCREEN_WIDTH), dtype=numpy.uint8)
+        codes[:MAP_HEIGHT, :MAP_WIDTH] = (map.explored * (1 + map.block_sight + 2 * visible)).reshape(MAP_HEIGHT, MAP_WIDTH)
+        libtcod.console_fill_background_rgb(con, tile_palette[codes])
+    else:
+        tile_codes = [e and (1 + w + 2 * v) for e, w, v in zip(map.explored, map.block_sight, visible)]
+        codes = []
+        for y in range(MAP_HEIGHT):
+            codes.extend(tile_codes[y * MAP_WIDTH:(y + 1) * MAP_WIDTH])
+            codes.extend([0] * (SCREEN_WIDTH - MAP_WIDTH))
+        codes.extend([0] * (SCREEN_WIDTH * (SCREEN_HEIGHT - MAP_HEIGHT)))
+        libtcod.console_fill_background(con, [TILE_COLORS[c].r for c in codes], [TILE_COLORS[c].g for c in codes], [TILE_COLORS[c].b for c in codes])
+
+def render_objects():
+    #draw the objects in view on con, but only on tiles whose glyph changed since the last
+    #frame (or that lost theirs). returns those tiles
+    global drawn_glyphs
+    glyphs = {}
+    #later objects are drawn over earlier ones on the same tile; draw player last
+    for object in objects:
+        if object is not player and (in_fov(object.x, object.y) or (object.always_visible and map[object.x][object.y].explored)):
+            glyphs[object.x, object.y] = (object.char, object.color)
+    if in_fov(player.x, player.y):
+        glyphs[player.x, player.y] = (player.char, player.color)
+    #spell effects on top of everything
+    for effect in effects:
+        glyphs.update(effect)
+
+    changed = []
+    chars = []
+    colors = []
+    for (x, y), (char, color) in glyphs.iteritems():
+        old = drawn_glyphs.get((x, y))
+        if old is None or old[0] != char or old[1] is not color:
+            changed.append((x, y))
+            chars.append(char)
+            colors.append(color)
+    for (x, y), (char, color) in drawn_glyphs.iteritems():
+        if (x, y) not in glyphs:
+            changed.append((x, y))
+            chars.append(' ')
+            colors.append(color)
+    #all of them in one go
+    if changed:
+        xs, ys = zip(*changed)
+        libtcod.console_put_chars(con, xs, ys, chars, colors)
+    drawn_glyphs = glyphs
+    return changed
+
+def render_panel(redraw):
+    #draw the parts of the panel whose content changed since the last frame (all of them if
+    #redraw is true) and blit them to the root console. returns True if any was
+    fighter = player.fighter
+    parts = [('names', 0, 0, SCREEN_WIDTH, 1, get_names_under_mouse()),
+             ('bars', 0, 1, MSG_X, 3, (fighter.hp, fighter.max_hp, fighter.mana, fighter.max_mana, fighter.xp, player.level)),
+             ('gold', 0, 5, MSG_X, 1, gold),
+             ('messages', MSG_X, 1, MSG_WIDTH, MSG_HEIGHT, [(line, color.r, color.g, color.b) for line, color in game_msgs])]
+    if redraw:
+        panel_drawn.clear()
+        libtcod.console_set_default_background(panel, libtcod.black)
+        libtcod.console_clear(panel)
+
+    changed = False
+    for name, x, y, width, height, content in parts:
+        if panel_drawn.get(name) == content:
+            continue
+        panel_drawn[name] = content
+        changed = True
+        if not redraw:
+            #clear just this part
+            libtcod.console_set_default_background(panel, libtcod.black)
+            libtcod.console_rect(panel, x, y, width, height, True, libtcod.BKGND_SET)
+
+        if name == 'names':
+            #names of objects under the mouse
+            libtcod.console_set_default_foreground(panel, libtcod.light_gray)
+            libtcod.console_print_ex(panel, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT, content)
+        elif name == 'bars':
+            #player's stats
+            render_bar(1, 1, BAR_WIDTH, 'HP', fighter.hp, fighter.max_hp, libtcod.light_red, libtcod.darker_red)
+            render_bar(1, 2, BAR_WIDTH, 'Mana', fighter.mana, fighter.max_mana, libtcod.light_blue, libtcod.darker_blue)
+            render_bar(1, 3, BAR_WIDTH, 'Exp', fighter.xp, LEVEL_UP_BASE + LEVEL_UP_FACTOR * player.level, libtcod.light_yellow, libtcod.darker_yellow)
+        elif name == 'gold':
+            libtcod.console_set_default_foreground(panel, libtcod.white)
+            libtcod.console_print_ex(panel, 1, 5, libtcod.BKGND_NONE, libtcod.LEFT, 'Gold: ' + str(gold))
+        else:
+            #the game messages, one line at a time
+            for i, (line, color) in enumerate(game_msgs):
+                libtcod.console_set_default_foreground(panel, color)
+                libtcod.console_print_ex(panel, MSG_X, y + i, libtcod.BKGND_NONE, libtcod.LEFT, line)
+
+        if not redraw:
+            libtcod.console_blit(panel, x, y, width, height, 0, x, PANEL_Y + y)
+
+    if redraw:
+        libtcod.console_blit(panel, 0, 0, SCREEN_WIDTH, PANEL_HEIGHT, 0, 0, PANEL_Y)
+    return changed or redraw
+
+def show_effect(tiles, char, color):
+    #draw char over the given tiles for EFFECT_MILLI milliseconds. without a window
+    #there is no one to see it
+    if headless:
+        return
+    effect = dict(((x, y), (char, color)) for x, y in tiles if in_fov(x, y))
+    effects.append(effect)
+    schedule_wakeup(EFFECT_MILLI, lambda: effects.remove(effect))
+
+def redraw_screen():
+    #something was drawn over the root console (a menu, say): draw all of it again next frame
+    global screen_damaged
+    screen_damaged = True
 
 def render_all():
-    global fov_map
-    global color_dark_wall, color_light_wall
-    global color_dark_ground, color_light_ground
-    global fov_recompute
+    #draw what changed since the last frame, and blit only that to the root console.
+    #returns False if nothing did, so there is no need to flush
+    global fov_recompute, screen_damaged
 
+    redraw = screen_damaged
+    screen_damaged = False
     if fov_recompute:
         #recompute FOV if needed (the player moved or something)
         fov_recompute = False
-        libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
+        update_fov()
 
-        #create all tiles
-        for y in range(MAP_HEIGHT):
-            for x in range(MAP_WIDTH):
-                visible = libtcod.map_is_in_fov(fov_map, x, y)
-                wall = map[x][y].block_sight
-                if not visible:
-                    #if it's not visible right now, the player can only see it if it's explored
-                    if map[x][y].explored:
-                        #out of player's POV
-                        if wall:
-                            libtcod.console_set_char_background(con, x, y, color_dark_wall, libtcod.BKGND_SET)
-                        else:
-                            libtcod.console_set_char_background(con, x, y, color_dark_ground, libtcod.BKGND_SET)
-                else:
-                    #it's visible
-                    if wall:
-                        libtcod.console_set_char_background(con, x, y, color_light_wall, libtcod.BKGND_SET)
-                    else:
-                        libtcod.console_set_char_background(con, x, y, color_light_ground, libtcod.BKGND_SET)
-                    #since it's visible, mark as explored
-                    map[x][y].explored = True
+        #set the background of all tiles at once
+        render_tiles(visible_tiles)
+        redraw_map = True
+    else:
+        redraw_map = redraw
 
-    #draw all objects in the list; draw player last
-    for object in objects:
-        if object != player:
-            object.draw()
-    player.draw()
+    changed = render_objects()
 
-    #draw from remote to root
-    libtcod.console_blit(con, 0, 0, SCREEN_WIDTH, SCREEN_HEIGHT, 0, 0, 0)
+    #draw from remote to root: the whole map, or the rectangle around the tiles that changed
+    if redraw_map:
+        libtcod.console_blit(con, 0, 0, MAP_WIDTH, MAP_HEIGHT, 0, 0, 0)
+    elif changed:
+        x1 = min(x for x, y in changed)
+        y1 = min(y for x, y in changed)
+        x2 = max(x for x, y in changed)
+        y2 = max(y for x, y in changed)
+        libtcod.console_blit(con, x1, y1, x2 - x1 + 1, y2 - y1 + 1, 0, x1, y1)
 
     #gui
-    libtcod.console_set_default_background(panel, libtcod.black)
-    libtcod.console_clear(panel)
-
-    #print the game messages, one line at a time
-    y = 1
-    for (line, color) in game_msgs:
-        libtcod.console_set_default_foreground(panel, color)
-        libtcod.console_print_ex(panel, MSG_X, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
-        y += 1
-
-    #show player's stats
-    render_bar(1, 1, BAR_WIDTH, 'HP', player.fighter.hp, player.fighter.max_hp, libtcod.light_red, libtcod.darker_red)
-    render_bar(1, 2, BAR_WIDTH, 'Mana', player.fighter.mana, player.fighter.max_mana, libtcod.light_blue, libtcod.darker_blue)
-    render_bar(1, 3, BAR_WIDTH, 'Exp', player.fighter.xp, LEVEL_UP_BASE + LEVEL_UP_FACTOR * player.level, libtcod.light_yellow, libtcod.darker_yellow)
-    libtcod.console_print_ex(panel, 1, 5, libtcod.BKGND_NONE, libtcod.LEFT, 'Gold: ' + str(gold))
-
-    #display names of objects under the mouse
-    libtcod.console_set_default_foreground(panel, libtcod.light_gray)
-    libtcod.console_print_ex(panel, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT, get_names_under_mouse())
-
-    #blit the contents of "panel" to the root console
-    libtcod.console_blit(panel, 0, 0, SCREEN_WIDTH, PANEL_HEIGHT, 0, 0, PANEL_Y)
+    panel_changed = render_panel(redraw)
+    return redraw_map or bool(changed) or panel_changed
+
+def add_object(obj):
+    #put an object on the map, at its current coordinates
+    objects.append(obj)
+    index_object(obj)
+    mark_dirty(obj)
+    objects_changed()
+
+def remove_object(obj):
+    #take an object off the map
+    objects.remove(obj)
+    unindex_object(obj)
+    mark_dirty(obj)
+    objects_changed()
+
+def index_object(obj):
+    object_index.setdefault((obj.x, obj.y), []).append(obj)
+
+def unindex_object(obj):
+    bucket = object_index[(obj.x, obj.y)]
+    bucket.remove(obj)
+    if not bucket:
+        del object_index[(obj.x, obj.y)]
+
+def index_objects():
+    #rebuild the tile index from scratch (after loading a game)
+    global object_index
+    object_index = {}
+    for obj in objects:
+        index_object(obj)
+
+def own_ai(monster):
+    #a monster's own AI, under any confusion
+    ai = monster.ai
+    while isinstance(ai, ConfusedMonster):
+        ai = ai.old_ai
+    return ai
+
+def action_time(obj):
+    #how long an action takes the given fighter
+    return TURN_TIME * NORMAL_SPEED // obj.fighter.speed
+
+def schedule(time, monster, event):
+    #add an event to the schedule. at the same time, events of monsters that woke up earlier come first
+    heapq.heappush(schedule_events, (time, own_ai(monster).awake, event, monster))
+
+def index_monsters():
+    #rebuild the active set of the current level, in the order its monsters woke up, and their
+    #schedule. a level left a while ago catches up with the game time
+    global active_monsters, wake_count, schedule_events
+    active_monsters = [obj for obj in objects if obj.ai and own_ai(obj).awake]
+    active_monsters.sort(key = lambda obj: own_ai(obj).awake)
+    wake_count = max([wake_count] + [own_ai(obj).awake for obj in active_monsters])
+    schedule_events = []
+    for monster in active_monsters:
+        monster.fighter.next_time = max(monster.fighter.next_time, game_time)
+        schedule(monster.fighter.next_time, monster, ACTS)
+        ai = monster.ai
+        while isinstance(ai, ConfusedMonster):
+            schedule(max(ai.ends, game_time), monster, CONFUSION_ENDS)
+            ai = ai.old_ai
+
+def wake(monster):
+    #a sleeping monster joins the active set, and acts right away (after the ones already awake)
+    global wake_count
+    ai = own_ai(monster)
+    if ai is not None and not ai.awake:
+        wake_count += 1
+        ai.awake = wake_count
+        active_monsters.append(monster)
+        monster.fighter.next_time = game_time
+        schedule(game_time, monster, ACTS)
+        mark_dirty(monster)
+
+def fall_asleep(monster):
+    #its events stay in the schedule, but are skipped
+    own_ai(monster).awake = 0
+    monster.fighter.next_time = 0
+    active_monsters.remove(monster)
+    mark_dirty(monster)
+
+def end_confusion(monster):
+    #drop every confusion of the monster that is over by now
+    if not isinstance(monster.ai, ConfusedMonster):
+        return
+    confusions = []
+    ai = monster.ai
+    while isinstance(ai, ConfusedMonster):
+        if ai.ends > game_time:
+            confusions.append(ai)
+        ai = ai.old_ai
+    for confusion in reversed(confusions):
+        confusion.old_ai = ai
+        ai = confusion
+    monster.ai = ai
+    mark_dirty(monster)
+    if not isinstance(ai, ConfusedMonster):
+        message('The ' + monster.name + ' is no longer confused!', libtcod.red)
+
+def wake_around(x, y, radius):
+    #wake the monsters within radius tiles of (x, y)
+    for ty in range(max(y - radius, 0), min(y + radius + 1, MAP_HEIGHT)):
+        for tx in range(max(x - radius, 0), min(x + radius + 1, MAP_WIDTH)):
+            for obj in objects_at(tx, ty):
+                if obj.ai:
+                    wake(obj)
+
+def wake_visible_monsters():
+    #wake the monsters in the player's FOV. sleeping monsters don't move, so this is
+    #only needed when the FOV is recomputed
+    if numpy_available:
+        visible = numpy.flatnonzero(visible_tiles).tolist()
+    else:
+        visible = [i for i, v in enumerate(visible_tiles) if v]
+    for i in visible:
+        for obj in objects_at(i % MAP_WIDTH, i // MAP_WIDTH):
+            if obj.ai:
+                wake(obj)
+
+def take_monster_turns():
+    #the player acted: the monsters near the player wake up, then everything in the schedule
+    #until the player's next action happens, in time order
+    global game_time
+    wake_around(player.x, player.y, WAKE_DISTANCE)
+    end = game_time + action_time(player)
+    while schedule_events and schedule_events[0][0] < end:
+        time, order, event, monster = heapq.heappop(schedule_events)
+        game_time = time
+        if event == CONFUSION_ENDS:
+            end_confusion(monster)
+        elif monster.ai and own_ai(monster).awake and monster.fighter.next_time == time:
+            #(events of dead monsters, sleeping ones and stale events are skipped)
+            monster.fighter.next_time = time + action_time(monster)
+            monster.ai.take_turn()
+            if monster.ai and own_ai(monster).awake:
+                schedule(monster.fighter.next_time, monster, ACTS)
+    game_time = end
+
+def objects_at(x, y):
+    #return the objects on the given tile, in drawing order
+    return object_index.get((x, y), ())
 
 def is_blocked(x, y):
     #first test the map tile
-    if map[x][y].blocked:
+    if map.blocked[y * map.width + x]:
         return True
 
     #now check for any blocking objects
-    for object in objects:
-        if object.blocks and object.x == x and object.y == y:
+    for object in objects_at(x, y):
+        if object.blocks:
             return True
 
     return False
@@ -839,14 +1271,15 @@ def player_move_or_attack(dx, dy):
 
     #try to find an attackable object there
     target = None
-    for object in objects:
-        if object.fighter and object.x == x and object.y == y:
+    for object in objects_at(x, y):
+        if object.fighter:
             target = object
             break
 
     #attack if target found, move otherwise
     if target is not None:
         player.fighter.attack(target)
+        wake_around(x, y, NOISE_RADIUS)
     else:
         player.move(dx, dy)
         fov_recompute = True
@@ -878,7 +1311,8 @@ def check_level_up():
         elif choice == 3:
             player.fighter.max_mana += 15
             player.fighter.mana += 15
-        time.sleep(1)
+        if not headless:
+            time.sleep(1)
         choices = None
         while choices == None and choice != None:
             choices = menu('Level up! Choose a skill to raise:\n',
@@ -903,13 +1337,15 @@ def get_names_under_mouse():
     (x, y) = (mouse.cx, mouse.cy)
 
     #create a list with the names of all objects at the mouse's coordinates and in FOV
-    names = [obj.name for obj in objects if obj.x == x and obj.y == y and libtcod.map_is_in_fov(fov_map, obj.x, obj.y)]
+    names = [obj.name for obj in objects_at(x, y) if in_fov(obj.x, obj.y)]
     names = ', '.join(names) #joins the name, separated by commas
     return names.capitalize()
 
 def target_tile(max_range = None):
     #return position of tile left-clicked in player's FOV or (None, None) if right-clicked
     global key, mouse
+    if headless:
+        return input_driver.target_tile(max_range)
     while True:
         #render the screen. This erase the inventory and shows the name of objects under the mouse
         libtcod.console_flush()
@@ -918,7 +1354,7 @@ def target_tile(max_range = None):
 
         x, y = mouse.cx, mouse.cy
 
-        if mouse.lbutton_pressed and libtcod.map_is_in_fov(fov_map, x, y) and (max_range is None or player.distance(x, y) <= max_range):
+        if mouse.lbutton_pressed and in_fov(x, y) and (max_range is None or player.distance(x, y) <= max_range):
             return (x, y)
         if mouse.rbutton_pressed or key.vk == libtcod.KEY_ESCAPE:
             return (None, None) #cancel
@@ -931,13 +1367,16 @@ def target_monster(max_range = None):
             return None
 
         #return first clicked monster, otherwise continue
-        for obj in objects:
-            if obj.x == x and obj.y == y and obj.fighter and obj != player:
+        for obj in objects_at(x, y):
+            if obj.fighter and obj != player:
                 return obj
 
 def menu(header, options, width):
     if len(options) > 26:
         raise ValueError('Cannot have a menu with more than 26 options.')
+    if headless:
+        #no window to draw on, let the input driver pick
+        return input_driver.choose(header, options)
     #calculate total height for the header (after auto-wrape) and one line per option
     if header == '':
         header_height = 0
@@ -973,6 +1412,9 @@ def menu(header, options, width):
     if key.vk == libtcod.KEY_ENTER and key.lalt:  #(special case) Alt+Enter: toggle fullscreen
         libtcod.console_set_fullscreen(not libtcod.console_is_fullscreen())
 
+    #the menu was drawn over the game's screen
+    redraw_screen()
+
     #convert the ASCII code to an index; if it corresponds to an option, return it
     index = key.c - ord('a')
     if index >= 0 and index < len(options):
@@ -1023,8 +1465,16 @@ def equipped_menu(header):
 def handle_keys():
     global key;
     #key = libtcod.console_wait_for_keypress(True)
+    if travel_goal is not None and game_state == 'playing':
+        #keep travelling until a key is pressed
+        if key.vk == libtcod.KEY_NONE:
+            return travel_step()
+        stop_travel()
+        return 'didnt-take-turn'
+
     if key.vk == libtcod.KEY_ENTER and key.lalt:
         libtcod.console_set_fullscreen(not libtcod.console_is_fullscreen())
+        redraw_screen()
     elif key.vk == libtcod.KEY_ESCAPE:
         return 'exit' #exit game
 
@@ -1050,14 +1500,14 @@ def handle_keys():
             key_char = chr(key.c)
             if key_char == 'g':
                 #pick up an item
-                for object in objects: #look for an item in the player's tile
-                    if object.x == player.x and object.y == player.y and object.item:
+                for object in objects_at(player.x, player.y): #look for an item in the player's tile
+                    if object.item:
                         object.item.pick_up()
                         break
             if key_char == 'f':
                 #pick up an equipment
-                for object in objects:
-                    if object.x == player.x and object.y == player.y and object.equip:
+                for object in list(objects_at(player.x, player.y)):
+                    if object.equip:
                         object.equip.pick_up()
             if key_char == 'i':
                 #show the inventory; if an item is selected, use it
@@ -1087,10 +1537,16 @@ def handle_keys():
                 if chosen_item is not None:
                     chosen_item.drop()
             if key_char == ',':
-                #go down stairs, if the player is on them
+                #take the stairs the player is on: down (once the boss is dead) or back up
                 if stairs.x == player.x and stairs.y == player.y:
                     if not boss:
                        next_level()
+                elif up_stairs and up_stairs.x == player.x and up_stairs.y == player.y:
+                    previous_level()
+            if key_char in TRAVEL_KEYS:
+                #explore, or walk to the stairs or the closest item, over several turns
+                start_travel(TRAVEL_KEYS[key_char])
+                return travel_step()
             if key_char == 'c':
                 #show character information
                 level_up_xp = LEVEL_UP_BASE + player.level * LEVEL_UP_FACTOR
@@ -1099,63 +1555,120 @@ def handle_keys():
                     '\nAttack: ' + str(player.fighter.power) + '\nDefense: ' + str(player.fighter.defense), CHARACTER_SCREEN_WIDTH)
             return 'didnt-take-turn'
 
+def stream_seed(seed, stream):
+    #derive the seed of a random stream (a dungeon level, LOOT_STREAM or COMBAT_STREAM) from the world seed
+    return (seed * 1000003 + stream * 7919) & 0x7fffffff
+
+def draw_seed(rnd):
+    return libtcod.random_get_int(rnd, 0, 0x7fffffff)
+
+def new_rng(old, seed):
+    #replace a random generator with a new one seeded with seed
+    if old:
+        libtcod.random_delete(old)
+    return libtcod.random_new_from_seed(seed)
+
+def seed_game(seed):
+    #start the random streams of a new game
+    global world_seed
+    world_seed = seed
+    start_streams(0, 0)
+
+def start_streams(loot_draws, combat_draws):
+    #start the loot and combat streams from the world seed, then skip the numbers already
+    #drawn from them, so a loaded game goes on rolling what the saved one would have
+    for stream, draws in ((LOOT_STREAM, loot_draws), (COMBAT_STREAM, combat_draws)):
+        rnd = streams[stream] = new_rng(streams.get(stream), stream_seed(world_seed, stream))
+        for i in xrange(draws):
+            libtcod.random_get_int(rnd, 0, 1)
+        stream_draws[stream] = draws
+
+def stream_int(stream, mi, ma):
+    #a number from the loot or combat stream, counting the numbers drawn for the savegame
+    #(libtcod draws none when there is only one choice)
+    if mi != ma:
+        stream_draws[stream] += 1
+    return libtcod.random_get_int(streams[stream], mi, ma)
+
 def next_level():
     #advance to the next level
     global dungeon_level
-    message('You take a moment to rest, and recover your strength.', libtcod.light_violet)
-    player.fighter.heal(player.fighter.max_hp / 2) #heal the player by 50%
-
-    message('After a rare moment of peace, you descend deeper into the lair of cute puppies and kitties', libtcod.red)
+    leave_level()
     dungeon_level += 1
-    make_map() #create new level
+    level = level_store.take(dungeon_level)
+    if level is None:
+        message('You take a moment to rest, and recover your strength.', libtcod.light_violet)
+        player.fighter.heal(player.fighter.max_hp / 2) #heal the player by 50%
+
+        message('After a rare moment of peace, you descend deeper into the lair of cute puppies and kitties', libtcod.red)
+        level = take_level(dungeon_level) #create new level
+    else:
+        #back to a visited level, at its up stairs
+        message('You descend the stairs again.', libtcod.light_violet)
+        level.start = (level.up_stairs.x, level.up_stairs.y)
+    enter_level(level)
     initialize_fov()
+    pregenerate_next_level()
+
+def previous_level():
+    #go back up to the level above, at its stairs down
+    global dungeon_level
+    leave_level()
+    dungeon_level -= 1
+    level = level_store.take(dungeon_level)
+    if level is None:
+        #lost (the level store was cleared), generate it again
+        level = generate_level(world_seed, dungeon_level, player.level)
+    level.start = (level.stairs.x, level.stairs.y)
+    message('You climb back up the stairs.', libtcod.light_violet)
+    enter_level(level)
+    initialize_fov()
+    pregenerate_next_level()
+
+def pregenerate_next_level():
+    #start generating the level below in a worker thread, so taking the stairs doesn't have to wait for it
+    global level_job
+    level_job = None
+    if pregenerate_levels and dungeon_level + 1 not in level_store:
+        level_job = LevelJob(world_seed, dungeon_level + 1, player.level)
+        level_job.start()
+
+def shutdown():
+    #on exit, let the level worker finish before python tears the modules down, and remove
+    #the level store's temporary directory
+    if level_job is not None:
+        level_job.join()
+    level_store.reset()
+
+def take_level(dungeon_level):
+    #the pre-generated level if it is the one needed (the player may have leveled up since), otherwise generate it now
+    if level_job is not None:
+        level_job.join()
+        if level_job.key == (world_seed, dungeon_level, player.level) and level_job.level is not None:
+            return level_job.level
+    return generate_level(world_seed, dungeon_level, player.level)
 
 def cast_heal(ver):
-    #heal the player
+    #heal the player, as the healing item of that strength says (see POTION_EFFECTS)
     if player.fighter.hp == player.fighter.max_hp:
         message('You are already at full health.', libtcod.red)
         return 'cancelled'
-    elif ver == 1:
-        message('Your wounds start to feel better!', libtcod.light_violet)
-        player.fighter.heal(HEAL_AMOUNT)
-    elif ver == 2:
-        message('Your wounds are feeling better!', libtcod.violet)
-        player.fighter.heal(2 * HEAL_AMOUNT)
-    elif ver == 3:
-        message('What wounds?', libtcod.darker_violet)
-        player.fighter.heal(4 * HEAL_AMOUNT)
-    elif ver == 4:
-        message('Juices rejuvanate you!', libtcod.light_azure)
-        player.fighter.heal(.20 * player.fighter.max_hp)
-    elif ver == 5:
-        message('Your life is restored!', libtcod.azure)
-        player.fighter.heal(.50 * player.fighter.max_hp)
-    elif ver == 6:
-        message('Your wounds are no more', libtcod.darker_azure)
-        player.fighter.heal(.75 * player.fighter.max_hp)
+    amount, share, text, color = POTION_EFFECTS['heal', ver]
+    message(text, color)
+    if share:
+        amount += share / 100.0 * player.fighter.max_hp
+    player.fighter.heal(amount)
 
 def cast_restore(ver):
+    #restore the player's mana, as the mana item of that strength says
     if player.fighter.mana == player.fighter.max_mana:
         message('You are already at full mana', libtcod.blue)
         return 'cancelled'
-    elif ver == 1:
-        message('Ahh, the magic!', libtcod.light_violet)
-        player.fighter.restore(RESTORE_AMOUNT)
-    elif ver == 2:
-        message('Mana trickling through my veins!', libtcod.violet)
-        player.fighter.restore(2 * RESTORE_AMOUNT)
-    elif ver == 3:
-        message('What is health?', libtcod.darker_violet)
-        player.fighter.restore(4 * RESTORE_AMOUNT)
-    elif ver == 4:
-        message('Slow but steady', libtcod.light_azure)
-        player.fighter.restore(.20 * player.fighter.max_mana)
-    elif ver == 5:
-        message('Drunk on mana', libtcod.azure)
-        player.fighter.restore(.50 * player.fighter.max_mana)
-    elif ver == 6:
-        message('There is no spoon', libtcod.darker_azure)
-        player.fighter.restore(.75 * player.fighter.max_mana)
+    amount, share, text, color = POTION_EFFECTS['restore', ver]
+    message(text, color)
+    if share:
+        amount += share / 100.0 * player.fighter.max_mana
+    player.fighter.restore(amount)
 
 
 def cast_lightning(ver):
@@ -1166,8 +1679,10 @@ def cast_lightning(ver):
         return 'cancelled'
     else:
         #zap
+        show_effect(list(libtcod.line_iter(player.x, player.y, monster.x, monster.y))[1:], '*', libtcod.light_blue)
         message('A lightning bolt strikes the ' + monster.name + ' with a loud thunder! The damage is ' + str((1 + ver * .5 - .5) * LIGHTNING_DAMAGE) + ' hit points.', libtcod.light_blue)
         monster.fighter.take_damage((1 + ver * .5 - .5) * LIGHTNING_DAMAGE)
+        wake_around(monster.x, monster.y, NOISE_RADIUS)
 
 def cast_confuse(ver):
     #find closest enemy in-range and confuse it
@@ -1176,9 +1691,12 @@ def cast_confuse(ver):
     if monster is None:
         return 'cancelled'
     #replace the monster's AI with a "confused" one; after some turns restore old AI
+    wake(monster)
     old_ai = monster.ai
-    monster.ai = ConfusedMonster(old_ai)
+    monster.ai = ConfusedMonster(old_ai, game_time + CONFUSED_NUM_TURNS * TURN_TIME)
     monster.ai.owner = monster #tell the new component who owns it
+    schedule(monster.ai.ends, monster, CONFUSION_ENDS)
+    mark_dirty(monster)
     message('The eyes of the ' + monster.name + ' look vacant, as he starts to stumble around!', libtcod.light_green)
 
 def cast_fireball(ver):
@@ -1188,6 +1706,9 @@ def cast_fireball(ver):
     if x is None:
         return 'cancelled'
     message('The fireball explodes, burning everything within ' + str(FIREBALL_RADIUS) + ' tiles!', libtcod.orange)
+    wake_around(x, y, NOISE_RADIUS)
+    show_effect([(x + dx, y + dy) for dx in range(-FIREBALL_RADIUS, FIREBALL_RADIUS + 1)
+        for dy in range(-FIREBALL_RADIUS, FIREBALL_RADIUS + 1) if math.sqrt(dx ** 2 + dy ** 2) <= FIREBALL_RADIUS], '*', libtcod.orange)
 
     for obj in objects: #damage every fighter in range, including player
         if obj.distance(x, y) <= FIREBALL_RADIUS and obj.fighter:
@@ -1201,7 +1722,7 @@ def closest_monster(max_range):
     closest_dist = max_range + 1 #start with (slightly more than) maximum range
 
     for object in objects:
-        if object.fighter and not object == player and libtcod.map_is_in_fov(fov_map, object.x, object.y):
+        if object.fighter and not object == player and in_fov(object.x, object.y):
             #calculate distance between this object and the player
             dist = player.distance_to(object)
             if dist < closest_dist: #it's closer, so remember it
@@ -1227,10 +1748,10 @@ def monster_death(monster):
         new_eq_component = Equipment(monster.equip.equip.part, monster.equip.equip.stat, user = None)
         new_eq = Object(0, 0, monster.equip.char, monster.equip.name, libtcod.sepia, equip = new_eq_component)
         monster.equip = None
-        objects.append(new_eq)
         new_eq.x = monster.x
         new_eq.y = monster.y
-    will_gold = libtcod.random_get_int(0, 0, 100)
+        add_object(new_eq)
+    will_gold = stream_int(LOOT_STREAM, 0, 100)
     gold_change = 0
     if will_gold > 25:
         full_name = monster.name.split()
@@ -1241,30 +1762,7 @@ def monster_death(monster):
         else:
             gold_change += 10
 
-        if monster.char == 's':
-            gold_change += 0
-        elif monster.char == 'w':
-            gold_change += 5
-        elif monster.char == 'b':
-            gold_change += 10
-        elif monster.char == 'S':
-            gold_change += 15
-        elif monster.char == 'o':
-            gold_change += 20
-        elif monster.char == 'V':
-            gold_change += 25
-        elif monster.char == 'W':
-            gold_change += 30
-        elif monster.char == 'T':
-            gold_change += 35
-        elif monster.char == 'M':
-            gold_change += 40
-        elif monster.char == 'G':
-            gold_change += 45
-        elif monster.char == 'm':
-            gold_change += 90
-        elif monster.char == 'B':
-            gold_change += 190
+        gold_change += MONSTER_GOLD.get(monster.char, 0) #what its kind is worth
     message('You got ' + str(gold_change) + ' gold')
     gold += gold_change
     monster.char = '%'
@@ -1273,10 +1771,269 @@ def monster_death(monster):
         boss = False
     monster.blocks = False
     monster.fighter = None
+    if monster in active_monsters:
+        active_monsters.remove(monster)
     monster.ai = None
     monster.name = 'reamins of ' + monster.name
     monster.send_to_back()
 
+class MonsterType:
+    #what place_objects can spawn. chance is the threshold a roll from 0 to 100 must stay under
+    #to get this type or one before it, as (base, minus per player level, minus per dungeon level).
+    #colors are for weak, strong and elite monsters
+    def __init__(self, name, char, colors, hp, defense, power, xp, chance):
+        self.name = name
+        self.char = char
+        self.colors = colors
+        self.hp = hp
+        self.defense = defense
+        self.power = power
+        self.xp = xp
+        self.chance = chance
+
+    def threshold(self, dungeon_level, player_level):
+        base, per_player_level, per_dungeon_level = self.chance
+        return base - player_level * per_player_level - dungeon_level * per_dungeon_level
+
+    def create(self, x, y, rarity = None, boss = False):
+        #a new monster of this type. a rarity from 0 to 100 makes it weak, strong (above 75) or
+        #elite (above 95). without one (as for bosses), it is just what the type says
+        fighter_component = Fighter(hp = self.hp, defense = self.defense, power = self.power, xp = self.xp, death_function = monster_death, boss = boss)
+        ai_component = BasicMonster()
+        monster = Object(x, y, self.char, self.name, self.colors[0], blocks = True, fighter = fighter_component, ai = ai_component)
+        if rarity is None:
+            return monster
+        if rarity <= 75:
+            monster.name = 'weak ' + monster.name
+        elif rarity <= 95:
+            monster.color = self.colors[1]
+            monster.fighter.hp = monster.fighter.hp * 5 / 4
+            monster.fighter.defense = monster.fighter.defense * 5 / 4
+            monster.fighter.power = monster.fighter.power * 5 / 4
+            monster.fighter.xp = monster.fighter.xp * 5 / 4
+        else:
+            monster.color = self.colors[2]
+            monster.fighter.hp = monster.fighter.hp * 2
+            monster.fighter.defense = monster.fighter.defense * 2
+            monster.fighter.power = monster.fighter.power * 2
+            monster.fighter.xp = monster.fighter.xp * 2
+            monster.name = 'elite ' + monster.name
+        return monster
+
+class ItemType:
+    #an item place_objects can spawn when a roll from 0 to 1000 is under its threshold, and above
+    #the one of the type before it
+    def __init__(self, name, char, color, use_function, strength, threshold):
+        self.name = name
+        self.char = char
+        self.color = color
+        self.use_function = use_function
+        self.strength = strength
+        self.threshold = threshold
+
+    def create(self, x, y):
+        item_component = Item(use_function = self.use_function, strength = self.strength)
+        return Object(x, y, self.char, self.name, self.color, item = item_component)
+
+#the monsters place_objects can roll (weakest and most common first), the bosses by name,
+#the gold of each kind of monster by char, the items and their thresholds, and the potion
+#effects by (effect, strength): all filled from the cfg files by build_definitions
+MONSTER_TYPES = []
+BOSS_TYPES = {}
+MONSTER_GOLD = {}
+ITEM_TYPES = []
+ITEM_THRESHOLDS = []
+POTION_EFFECTS = {}
+
+#the thresholds of MONSTER_TYPES by (dungeon level, player level), see spawn_table
+spawn_tables = {}
+
+def spawn_table(dungeon_level, player_level):
+    #the thresholds of every monster type for a dungeon level and player level, worked out once.
+    #they never go down along the list, so a roll can be looked up with bisect: a type whose
+    #threshold is under the one before it can't be rolled, and gets that one instead
+    key = (dungeon_level, player_level)
+    table = spawn_tables.get(key)
+    if table is None:
+        table = []
+        for monster_type in MONSTER_TYPES:
+            threshold = monster_type.threshold(dungeon_level, player_level)
+            table.append(max(table[-1], threshold) if table else threshold)
+        spawn_tables[key] = table
+    return table
+
+#what load_definitions reads from the cfg files, as plain values. colors are (r, g, b) and
+#item effects are names from ITEM_EFFECTS
+ITEM_EFFECTS = {'heal': cast_heal, 'restore': cast_restore, 'lightning': cast_lightning,
+                'fireball': cast_fireball, 'confuse': cast_confuse}
+MONSTER_PROPERTIES = [('glyph', libtcod.TYPE_CHAR, True), ('base_color', libtcod.TYPE_COLOR, True),
+                      ('strong_color', libtcod.TYPE_COLOR, False), ('elite_color', libtcod.TYPE_COLOR, False),
+                      ('hp', libtcod.TYPE_INT, True), ('defense', libtcod.TYPE_INT, True),
+                      ('power', libtcod.TYPE_INT, True), ('xp', libtcod.TYPE_INT, True),
+                      ('gold', libtcod.TYPE_INT, False), ('chance', libtcod.TYPE_FLOAT, False),
+                      ('chance_per_player_level', libtcod.TYPE_FLOAT, False),
+                      ('chance_per_dungeon_level', libtcod.TYPE_FLOAT, False)]
+ITEM_PROPERTIES = [('glyph', libtcod.TYPE_CHAR, True), ('base_color', libtcod.TYPE_COLOR, True),
+                   ('strength', libtcod.TYPE_INT, False), ('threshold', libtcod.TYPE_INT, True),
+                   ('amount', libtcod.TYPE_INT, False), ('share', libtcod.TYPE_INT, False),
+                   ('message', libtcod.TYPE_STRING, False), ('message_color', libtcod.TYPE_COLOR, False)]
+
+class DefinitionListener:
+    #collects the structs of a cfg file as (name, {property: value}), with flags set to True
+    def __init__(self):
+        self.structs = []
+        self.errors = []
+
+    def new_struct(self, struct, name):
+        self.structs.append((name, {}))
+        return True
+
+    def new_flag(self, name):
+        self.structs[-1][1][name] = True
+        return True
+
+    def new_property(self, name, typ, value):
+        if typ == libtcod.TYPE_COLOR:
+            value = (value.r, value.g, value.b) #the Color is only valid during the call
+        elif typ == libtcod.TYPE_FLOAT:
+            value = float('%g' % value) #back from single precision, so .3 stays .3
+        self.structs[-1][1][name] = value
+        return True
+
+    def end_struct(self, struct, name):
+        return True
+
+    def error(self, msg):
+        self.errors.append(msg)
+        return True
+
+def parse_definitions(filename, struct_name, properties, flags = [], value_lists = []):
+    #run the libtcod parser over a cfg file, for structs of the given name. returns their
+    #(name, {property: value}) in file order
+    parser = libtcod.parser_new()
+    struct = libtcod.parser_new_struct(parser, struct_name)
+    for name, typ, mandatory in properties:
+        libtcod.struct_add_property(struct, name, typ, mandatory)
+    for name in flags:
+        libtcod.struct_add_flag(struct, name)
+    for name, values, mandatory in value_lists:
+        libtcod.struct_add_value_list(struct, name, values, mandatory)
+    listener = DefinitionListener()
+    libtcod.parser_run(parser, os.path.join(CFG_FOLDER, filename), listener)
+    libtcod.parser_delete(parser)
+    if listener.errors:
+        raise ValueError(filename + ': ' + '; '.join(listener.errors))
+    #this version of the parser doesn't check for missing mandatory properties itself
+    mandatory = [name for name, typ, needed in properties if needed]
+    mandatory += [name for name, values, needed in value_lists if needed]
+    for name, values in listener.structs:
+        for key in mandatory:
+            check_definition(filename, name, key in values, 'has no ' + key)
+    return listener.structs
+
+def check_definition(filename, name, ok, problem):
+    if not ok:
+        raise ValueError('%s: %s %s' % (filename, name, problem))
+
+def compile_definitions():
+    #parse and check the cfg files. returns (monsters, items), lists of (name, {property: value})
+    #with every optional property filled in
+    monsters = parse_definitions(MONSTERS_FILE, 'monster', MONSTER_PROPERTIES, flags = ['boss'])
+    chars = set()
+    last_chance = None
+    for name, values in monsters:
+        check_definition(MONSTERS_FILE, name, values['glyph'] not in chars, 'has the glyph of another monster')
+        chars.add(values['glyph'])
+        values.setdefault('boss', False)
+        values.setdefault('gold', 0)
+        if values['boss']:
+            values.setdefault('strong_color', values['base_color'])
+            values.setdefault('elite_color', values['base_color'])
+            continue
+        for key in ['strong_color', 'elite_color', 'chance', 'chance_per_player_level', 'chance_per_dungeon_level']:
+            check_definition(MONSTERS_FILE, name, key in values, 'has no ' + key)
+        check_definition(MONSTERS_FILE, name, last_chance is None or values['chance'] >= last_chance,
+            'has a lower chance than the monster before it')
+        last_chance = values['chance']
+    check_definition(MONSTERS_FILE, 'the file', last_chance is not None, 'has no monster that can be rolled')
+
+    items = parse_definitions(ITEMS_FILE, 'item', ITEM_PROPERTIES,
+        value_lists = [('effect', sorted(ITEM_EFFECTS), True)])
+    last_threshold = None
+    potions = set()
+    for name, values in items:
+        values.setdefault('strength', 1)
+        check_definition(ITEMS_FILE, name, last_threshold is None or values['threshold'] > last_threshold,
+            'has a threshold not above the item before it')
+        last_threshold = values['threshold']
+        if values['effect'] in ['heal', 'restore']:
+            key = (values['effect'], values['strength'])
+            check_definition(ITEMS_FILE, name, key not in potions, 'has the effect and strength of another item')
+            potions.add(key)
+            values.setdefault('amount', 0)
+            values.setdefault('share', 0)
+            check_definition(ITEMS_FILE, name, values['amount'] or values['share'], 'needs an amount or a share')
+            check_definition(ITEMS_FILE, name, 'message' in values and 'message_color' in values,
+                'needs a message and a message_color')
+    check_definition(ITEMS_FILE, 'the last item', last_threshold > 1000, 'needs a threshold above 1000')
+    return monsters, items
+
+def load_definitions():
+    #the compiled definitions, pickled in DEFINITIONS_CACHE so the parser only runs again when
+    #a cfg file changed since (or the cache is missing or unreadable)
+    stamp = (DEFINITIONS_VERSION, os.path.getmtime(os.path.join(CFG_FOLDER, MONSTERS_FILE)),
+             os.path.getmtime(os.path.join(CFG_FOLDER, ITEMS_FILE)))
+    try:
+        with open(DEFINITIONS_CACHE, 'rb') as file:
+            cached_stamp, definitions = cPickle.load(file)
+        if cached_stamp == stamp:
+            return definitions
+    except Exception:
+        pass
+
+    definitions = compile_definitions()
+    try:
+        with open(DEFINITIONS_CACHE + '.tmp', 'wb') as file:
+            cPickle.dump((stamp, definitions), file, cPickle.HIGHEST_PROTOCOL)
+        replace_file(DEFINITIONS_CACHE + '.tmp', DEFINITIONS_CACHE)
+    except (IOError, OSError):
+        pass #a read-only install parses the files every time
+    return definitions
+
+def build_definitions():
+    #fill the tables place_objects, monster_death and the potions use from the definitions
+    global MONSTER_TYPES, BOSS_TYPES, MONSTER_GOLD, ITEM_TYPES, ITEM_THRESHOLDS, POTION_EFFECTS
+    monsters, items = load_definitions()
+    MONSTER_TYPES = []
+    BOSS_TYPES = {}
+    MONSTER_GOLD = {}
+    for name, values in monsters:
+        colors = tuple(libtcod.Color(*values[key]) for key in ['base_color', 'strong_color', 'elite_color'])
+        chance = (values.get('chance'), values.get('chance_per_player_level'), values.get('chance_per_dungeon_level'))
+        monster_type = MonsterType(name, values['glyph'], colors, values['hp'], values['defense'],
+            values['power'], values['xp'], chance)
+        if values['boss']:
+            BOSS_TYPES[name] = monster_type
+        else:
+            MONSTER_TYPES.append(monster_type)
+        MONSTER_GOLD[values['glyph']] = values['gold']
+
+    ITEM_TYPES = []
+    POTION_EFFECTS = {}
+    for name, values in items:
+        ITEM_TYPES.append(ItemType(name, values['glyph'], libtcod.Color(*values['base_color']),
+            ITEM_EFFECTS[values['effect']], values['strength'], values['threshold']))
+        if values['effect'] in ['heal', 'restore']:
+            POTION_EFFECTS[values['effect'], values['strength']] = (values['amount'], values['share'],
+                values['message'], libtcod.Color(*values['message_color']))
+    ITEM_THRESHOLDS = [item_type.threshold for item_type in ITEM_TYPES]
+    spawn_tables.clear()
+
+#equipment a monster can carry: part, char and stat, for an equip roll from 0 to 100 above
+#the matching threshold (and not above the next one)
+EQUIP_DROPS = [('helmet', 'U', 1), ('torso', 'T', 1), ('leggings', 'M', 1), ('boots', 'b', 1), ('weapon', '/', 3)]
+EQUIP_THRESHOLDS = [80, 84, 88, 92, 96]
+
 def render_bar(x, y, total_width, name, value, maximum, bar_color, back_color):
     #render a bar (HP, experience, etc). first calculate the width of the bar
     bar_width = int(float(value) / maximum * total_width)
@@ -1327,8 +2084,17 @@ def main_menu():
         elif choice == 2: #quit
             break
 
-def new_game():
-    global player, equipped, equipment, inventory, gold, game_msgs, game_state, dungeon_level
+def new_game(seed = None):
+    global player, equipped, equipment, inventory, gold, game_msgs, game_state, dungeon_level, game_time, wake_count
+
+    journal.reset()
+    level_store.reset()
+    game_time = wake_count = 0
+
+    #a random world unless a seed is given
+    if seed is None:
+        seed = draw_seed(0)
+    seed_game(seed)
 
     #characters
     #create object representing the player
@@ -1344,6 +2110,7 @@ def new_game():
     #create map
     make_map()
     initialize_fov()
+    pregenerate_next_level()
 
     game_state = 'playing'
 
@@ -1360,91 +2127,732 @@ def new_game():
     Skills_levels()
 
 def initialize_fov():
-    global fov_recompute, fov_map
+    global fov_recompute, fov_map, visible_tiles, path_map, distances_origin, drawn_glyphs
     fov_recompute = True
+    visible_tiles = new_layer(MAP_WIDTH * MAP_HEIGHT, False)
     #fov
     libtcod.console_clear(con) #unexplored areas start black
+    drawn_glyphs = {}
     fov_map = libtcod.map_new(MAP_WIDTH, MAP_HEIGHT)
-    for y in range(MAP_HEIGHT):
-        for x in range(MAP_WIDTH):
-            libtcod.map_set_properties(fov_map, x, y, not map[x][y].block_sight, not map[x][y].blocked)
+    #copy the map layers into the FOV map in one go
+    if numpy_available:
+        libtcod.map_set_properties_bulk(fov_map, ~map.block_sight, ~map.blocked)
+    else:
+        libtcod.map_set_properties_bulk(fov_map, [not b for b in map.block_sight], [not b for b in map.blocked])
+    #walking distances from the player, over the same map
+    if path_map is not None:
+        libtcod.dijkstra_delete(path_map)
+    path_map = libtcod.dijkstra_new(fov_map)
+    distances_origin = None
+    #distance maps of travel commands are for the old map
+    travel_maps.clear()
+    stop_travel()
+
+def schedule_wakeup(delay, callback):
+    #have the game loop wake up after delay milliseconds, call callback and draw what changed
+    #(for animations, and anything else that moves by itself)
+    heapq.heappush(wakeups, (time.time() + delay / 1000.0, next(wakeup_order), callback))
+
+def run_wakeups():
+    #call back the wakeups that are due. returns True if there were any
+    due = False
+    while wakeups and wakeups[0][0] <= time.time():
+        heapq.heappop(wakeups)[2]()
+        due = True
+    return due
+
+def wait_for_input(timeout = None):
+    #sleep until a key is pressed, the mouse moves to another cell, a wakeup is due (see
+    #schedule_wakeup), the window is closed or timeout milliseconds are over. libtcod's own
+    #wait only returns for a key, so this checks for events LIMIT_FPS times a second: that
+    #costs next to nothing, as nothing is drawn in between. returns True for a key
+    deadline = None if timeout is None else time.time() + timeout / 1000.0
+    while True:
+        cell = (mouse.cx, mouse.cy)
+        if libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS|libtcod.EVENT_MOUSE, key, mouse) & libtcod.EVENT_KEY_PRESS:
+            return True
+        if (mouse.cx, mouse.cy) != cell or run_wakeups() or libtcod.console_is_window_closed():
+            return False
+        now = time.time()
+        if deadline is not None and now >= deadline:
+            return False
+        #sleep a frame, or less if the next wakeup or the deadline comes first
+        wake_at = [now + 1.0 / LIMIT_FPS] + [due for due, order, callback in wakeups[:1]]
+        if deadline is not None:
+            wake_at.append(deadline)
+        libtcod.sys_sleep_milli(max(0, int(math.ceil((min(wake_at) - now) * 1000))))
 
 def play_game():
     player_action = None
-    #game loop
+    #game loop: draw what changed, then sleep until the player presses a key (or something
+    #else changes what is drawn, see wait_for_input). travelling goes on by itself, so then
+    #it only checks for a key (that stops it) between steps
     while not libtcod.console_is_window_closed():
-        libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS|libtcod.EVENT_MOUSE, key, mouse)
-        render_all()
-
-        #print remote on root
-        libtcod.console_flush()
+        #while travelling, only one turn in TRAVEL_RENDER_STEPS is drawn
+        if travel_goal is None or travel_steps % TRAVEL_RENDER_STEPS == 0:
+            if render_all():
+                #print remote on root
+                libtcod.console_flush()
         check_level_up()
+        if screen_damaged and travel_goal is None:
+            continue #the level up menu was drawn over the game, draw it again before waiting
+
+        if travel_goal is not None:
+            wait_for_input(0)
+        elif not wait_for_input():
+            continue #the mouse moved or a wakeup was due: draw what changed, and wait again
+        if libtcod.console_is_window_closed():
+            break
 
-        #refresh
-        for object in objects:
-            object.clear()
         #handle keys
-        player_action = handle_keys()
+        playing = game_state == 'playing'
+        player_action = play_turn()
         if player_action == 'exit':
             save_game()
             break
+        if playing and player_action != 'didnt-take-turn':
+            autosave()
+
+def play_turn():
+    #handle the current key, then let the monsters act if the player took a turn
+    player_action = handle_keys()
+    if game_state == 'playing' and player_action not in ('didnt-take-turn', 'exit'):
+        take_monster_turns()
+    return player_action
+
+#savegame format: a header, a string table and a color table, then the game's records.
+#objects are a table of typed records, with one more table per kind of component; they
+#refer to each other by their index in the object table. the map layers are stored one
+#byte per tile, 8-byte aligned, so a loaded map can use them straight from the file
+SAVE_MAGIC = 'ROUGE'
+SAVE_VERSION = 5
+
+#a level in the level store: the same records, for one level
+LEVEL_MAGIC = 'RLEVL'
+
+#the journal next to a savegame holds one entry per turn since it was written, each with
+#the same layout as a savegame but only for what changed (see Journal)
+JOURNAL_MAGIC = 'RJRNL'
+JOURNAL_SNAPSHOT_TURNS = 200
+
+#functions objects refer to (death and item use), saved by name
+SAVED_FUNCTIONS = dict((function.__name__, function) for function in
+    [player_death, monster_death, cast_heal, cast_restore, cast_lightning, cast_confuse, cast_fireball])
+
+EQUIP_PARTS = ['helmet', 'torso', 'leggings', 'boots', 'weapon']
+
+#record formats. stats are a mask of number kinds (see number_kinds) followed by doubles
+OBJECT_RECORD = 'hhHHHBBi'    #x, y, char, name, color, blocks, always visible, level (-1 if none)
+FIGHTER_RECORD = 'iI8dHB5i'   #owner, stats (hp, max hp, defense, power, xp, mana, max mana, speed), death function, boss, worn equipment
+AI_RECORD = 'iBi'             #owner, kind, end time if confused (wake order if basic, 0 asleep). a confused monster's old AI follows it
+ITEM_RECORD = 'iIdH'          #owner, strength, use function
+EQUIPMENT_RECORD = 'iHIdi'    #owner, part, stat, user
+CARRIED_RECORD = 'ii'         #monster, the equipment object it carries
+SCHEDULE_RECORD = 'ii'        #awake monster, game time of its next action
+COMPONENT_RECORDS = [FIGHTER_RECORD, AI_RECORD, ITEM_RECORD, EQUIPMENT_RECORD, CARRIED_RECORD]
+FIGHTER, AI, ITEM, EQUIPMENT, CARRIED = range(5)
+
+AI_BASIC, AI_CONFUSED = range(2)
+
+#compiled struct formats, by format string
+save_structs = {}
+
+def save_struct(format):
+    if format not in save_structs:
+        save_structs[format] = struct.Struct('<' + format)
+    return save_structs[format]
+
+def number_kinds(*values):
+    #stats are ints, floats or None, and must come back the same (integer division depends on it).
+    #returns a mask with 2 bits per value, followed by the values as floats
+    kinds = 0
+    for i, value in enumerate(values):
+        if value is None:
+            kinds |= 2 << (2 * i)
+        elif isinstance(value, float):
+            kinds |= 1 << (2 * i)
+    return (kinds,) + tuple(float(value or 0) for value in values)
+
+def read_numbers(kinds, values):
+    result = []
+    for i, value in enumerate(values):
+        kind = (kinds >> (2 * i)) & 3
+        result.append(None if kind == 2 else value if kind == 1 else int(value))
+    return result
+
+def replace_file(source, target):
+    #os.rename can't overwrite a file on windows
+    if os.name == 'nt' and os.path.exists(target):
+        os.remove(target)
+    os.rename(source, target)
+
+class SaveWriter:
+    """
+    builds a savegame: records are packed as they are written, strings and colors
+    go to tables written in front of them
+    """
+    def __init__(self, magic = SAVE_MAGIC):
+        self.magic = magic
+        self.strings = []
+        self.string_ids = {}
+        self.colors = []
+        self.color_ids = {}
+        self.chunks = []
+
+    def pack(self, format, *values):
+        self.chunks.append(save_struct(format).pack(*values))
+
+    def table(self, format, records):
+        packer = save_struct(format)
+        self.pack('I', len(records))
+        self.chunks += [packer.pack(*record) for record in records]
+
+    def layer(self, layer):
+        #a map layer, one byte per tile
+        self.align()
+        if numpy_available:
+            self.chunks.append(numpy.asarray(layer, dtype=bool).tostring())
+        else:
+            self.chunks.append(str(layer))
+
+    def align(self):
+        self.chunks.append('\0' * (-sum(len(chunk) for chunk in self.chunks) % 8))
+
+    def string(self, text):
+        #the index of a string in the string table, 0 for None
+        if text is None:
+            return 0
+        if text not in self.string_ids:
+            self.strings.append(text)
+            self.string_ids[text] = len(self.strings)
+        return self.string_ids[text]
+
+    def color(self, color):
+        key = (color.r, color.g, color.b)
+        if key not in self.color_ids:
+            self.color_ids[key] = len(self.colors)
+            self.colors.append(key)
+        return self.color_ids[key]
+
+    def data(self):
+        header = [struct.pack('<5sHH', self.magic, SAVE_VERSION, len(self.strings))]
+        for text in self.strings:
+            header.append(struct.pack('<H', len(text)) + text)
+        header.append(struct.pack('<H', len(self.colors)))
+        header += [struct.pack('<BBB', *color) for color in self.colors]
+        header.append('\0' * (-sum(len(chunk) for chunk in header) % 8))
+        return ''.join(header + self.chunks)
+
+class SaveReader:
+    """
+    reads back what SaveWriter wrote, from a string or a memory map of the file
+    """
+    def __init__(self, data, magic = SAVE_MAGIC):
+        self.data = data
+        self.offset = 0
+        file_magic, version, count = self.unpack('5sHH')
+        if file_magic != magic or version != SAVE_VERSION:
+            raise ValueError('not a savegame, or from another version of the game')
+        self.strings = [None]
+        for i in range(count):
+            size, = self.unpack('H')
+            self.strings.append(self.bytes(size))
+        count, = self.unpack('H')
+        self.colors = [libtcod.Color(*self.unpack('BBB')) for i in range(count)]
+        self.align()
+
+    def unpack(self, format):
+        packer = save_struct(format)
+        values = packer.unpack_from(self.data, self.offset)
+        self.offset += packer.size
+        return values
+
+    def table(self, format):
+        count, = self.unpack('I')
+        packer = save_struct(format)
+        start = self.offset
+        self.offset += count * packer.size
+        return [packer.unpack_from(self.data, start + i * packer.size) for i in range(count)]
+
+    def bytes(self, size):
+        self.offset += size
+        return self.data[self.offset - size:self.offset]
+
+    def layer(self, size):
+        #a map layer: with NumPy, a view straight into the data (no copy)
+        self.align()
+        self.offset += size
+        if numpy_available:
+            return numpy.frombuffer(self.data, dtype=bool, count=size, offset=self.offset - size)
+        return bytearray(self.data[self.offset - size:self.offset])
+
+    def align(self):
+        self.offset += -self.offset % 8
+
+def collect_objects(roots):
+    #roots and every object they refer to. returns the list and each object's index
+    table = []
+    ids = {}
+    def collect(obj):
+        if not obj or id(obj) in ids:
+            return
+        ids[id(obj)] = len(table)
+        table.append(obj)
+        for other in referenced_objects(obj):
+            collect(other)
+    for obj in roots:
+        collect(obj)
+    return table, ids
+
+def referenced_objects(obj):
+    #the objects another object's components refer to
+    if isinstance(obj.equip, Equipment):
+        yield obj.equip.user
+    elif obj.equip:
+        yield obj.equip
+    if obj.fighter:
+        for part in EQUIP_PARTS:
+            slot = getattr(obj.fighter, part)
+            if slot:
+                yield slot.owner
+
+def write_globals(writer):
+    writer.pack('iiBH', dungeon_level, gold, boss, writer.string(game_state))
+    writer.pack('3I4i2I', world_seed, stream_draws[LOOT_STREAM], stream_draws[COMBAT_STREAM], skill1, skill2, skill3, skill4, game_time, wake_count)
+
+def read_globals(reader, state):
+    dungeon_level, gold, boss, game_state = reader.unpack('iiBH')
+    state['globals'] = (dungeon_level, gold, bool(boss), reader.strings[game_state]) + reader.unpack('3I4i2I')
+
+def write_objects(writer, table, ref):
+    #the object table and one table per kind of component, for the given objects
+    def function_name(function):
+        return writer.string(function and function.__name__)
+
+    writer.table(OBJECT_RECORD, [(obj.x, obj.y, writer.string(obj.char), writer.string(obj.name), writer.color(obj.color),
+        obj.blocks, obj.always_visible, getattr(obj, 'level', -1)) for obj in table])
+
+    components = [[] for format in COMPONENT_RECORDS]
+    for obj in table:
+        i = ref(obj)
+        fighter = obj.fighter
+        if fighter:
+            components[FIGHTER].append((i,) + number_kinds(fighter.hp, fighter.max_hp, fighter.defense, fighter.power, fighter.xp,
+                fighter.mana, fighter.max_mana, fighter.speed) + (function_name(fighter.death_function), fighter.boss) +
+                tuple(ref(getattr(fighter, part) and getattr(fighter, part).owner) for part in EQUIP_PARTS))
+        ai = obj.ai
+        while ai:
+            if isinstance(ai, ConfusedMonster):
+                components[AI].append((i, AI_CONFUSED, ai.ends))
+                ai = ai.old_ai
+            else:
+                components[AI].append((i, AI_BASIC, ai.awake))
+                ai = None
+        if obj.item:
+            components[ITEM].append((i,) + number_kinds(obj.item.strength) + (function_name(obj.item.use_function),))
+        if isinstance(obj.equip, Equipment):
+            components[EQUIPMENT].append((i, writer.string(obj.equip.part)) + number_kinds(obj.equip.stat) + (ref(obj.equip.user),))
+        elif obj.equip:
+            components[CARRIED].append((i, ref(obj.equip)))
+    for format, records in zip(COMPONENT_RECORDS, components):
+        writer.table(format, records)
+
+def read_objects(reader, ids, records):
+    #read the tables written by write_objects into records: object id -> the object's record
+    #followed by a list of records for each kind of component. ids are the objects' ids, in order
+    #(None in a savegame, where they are numbered from 0). strings and colors are looked up,
+    #since every journal entry has tables of its own
+    strings, colors = reader.strings, reader.colors
+    object_records = reader.table(OBJECT_RECORD)
+    if ids is None:
+        ids = range(len(object_records))
+    for i, (x, y, char, name, color, blocks, always_visible, level) in zip(ids, object_records):
+        records[i] = [(x, y, strings[char], strings[name], colors[color], blocks, always_visible, level)] + [[] for format in COMPONENT_RECORDS]
+    for kind, format in enumerate(COMPONENT_RECORDS):
+        for record in reader.table(format):
+            if kind == FIGHTER:
+                record = record[:10] + (strings[record[10]],) + record[11:]
+            elif kind == ITEM:
+                record = record[:3] + (strings[record[3]],)
+            elif kind == EQUIPMENT:
+                record = (record[0], strings[record[1]]) + record[2:]
+            records[record[0]][kind + 1].append(record)
+
+def build_objects(records):
+    #create the objects from their records, returns object id -> object
+    table = {}
+    for i, record in records.iteritems():
+        (x, y, char, name, color, blocks, always_visible, level) = record[0]
+        obj = Object(x, y, char, name, color, blocks = bool(blocks), always_visible = bool(always_visible))
+        if level >= 0:
+            obj.level = level
+        table[i] = obj
+
+    for i, record in records.iteritems():
+        obj = table[i]
+        #innermost AI first, so a confused monster's old AI exists when it is read
+        for (owner, kind, value) in reversed(record[AI + 1]):
+            obj.ai = ConfusedMonster(obj.ai, value) if kind == AI_CONFUSED else BasicMonster(value)
+            obj.ai.owner = obj
+        for (owner, kinds, strength, use_function) in record[ITEM + 1]:
+            obj.item = Item(SAVED_FUNCTIONS.get(use_function), read_numbers(kinds, [strength])[0])
+            obj.item.owner = obj
+        for (owner, part, kinds, stat, user) in record[EQUIPMENT + 1]:
+            obj.equip = Equipment(part, read_numbers(kinds, [stat])[0], table[user] if user >= 0 else None)
+            obj.equip.owner = obj
+        for (owner, carried) in record[CARRIED + 1]:
+            obj.equip = table[carried]
+
+    #fighters last, worn equipment refers to equipment components
+    for i, record in records.iteritems():
+        obj = table[i]
+        for fighter_record in record[FIGHTER + 1]:
+            hp, max_hp, defense, power, xp, mana, max_mana, speed = read_numbers(fighter_record[1], fighter_record[2:10])
+            fighter = Fighter(max_hp, defense, power, xp, mana, SAVED_FUNCTIONS.get(fighter_record[10]), boss = bool(fighter_record[11]), speed = speed)
+            fighter.hp = hp
+            fighter.max_mana = max_mana
+            for part, slot in zip(EQUIP_PARTS, fighter_record[12:]):
+                if slot >= 0:
+                    setattr(fighter, part, table[slot].equip)
+            fighter.owner = obj
+            obj.fighter = fighter
+    return table
+
+class Journal:
+    """
+    the autosave journal: after a savegame is written, each turn appends what changed to
+    the file next to it. objects are marked dirty when they change (mark_dirty), so an entry
+    costs in proportion to the turn, not to the whole level
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self, filename = None, table = (), ids = None):
+        #start over after writing the savegame filename, whose objects are table (ids maps id(obj) to their index)
+        self.filename = filename
+        self.active = filename is not None
+        self.objects = list(table)  #keeps every object with an id alive, so python never reuses its id()
+        self.ids = dict(ids or {})
+        self.dirty = {}
+        self.objects_changed = False
+        self.turns = 0
+        if self.active:
+            self.map = map
+            self.explored = numpy.array(map.explored) if numpy_available else bytearray(map.explored)
+            self.lists = self.current_lists()
+            self.messages = list(game_msgs)
+
+    def mark(self, obj):
+        self.dirty[id(obj)] = obj
+
+    def ref(self, obj):
+        #an object's id, giving one to (and marking) objects that don't have one yet
+        if not obj:
+            return -1
+        if id(obj) not in self.ids:
+            self.ids[id(obj)] = len(self.objects)
+            self.objects.append(obj)
+            self.mark(obj)
+        return self.ids[id(obj)]
+
+    def current_lists(self):
+        return ([self.ref(obj) for obj in inventory], [self.ref(obj) for obj in equipment],
+                [self.ref(equipped[part]) for part in EQUIP_PARTS])
+
+    def write(self):
+        #append an entry for this turn
+        writer = SaveWriter(JOURNAL_MAGIC)
+        write_globals(writer)
+
+        #tiles explored since the last entry
+        if numpy_available:
+            explored = numpy.flatnonzero(map.explored & ~self.explored)
+            self.explored[explored] = True
+        else:
+            explored = [i for i in xrange(len(map.explored)) if map.explored[i] and not self.explored[i]]
+            for i in explored:
+                self.explored[i] = 1
+        writer.table('I', [(i,) for i in explored])
+
+        #the player, everything that changed and any new objects they refer to
+        self.mark(player)
+        lists = self.current_lists()
+        changed = []
+        pending = self.dirty.values()
+        self.dirty = {}
+        while pending:
+            for obj in pending:
+                self.ref(obj)
+                for other in referenced_objects(obj):
+                    self.ref(other)
+                changed.append(obj)
+            pending = [obj for obj in self.dirty.values() if obj not in changed]
+            self.dirty = {}
+        writer.table('i', [(self.ids[id(obj)],) for obj in changed])
+        write_objects(writer, changed, self.ref)
+        writer.pack('2i', self.ref(stairs), self.ref(up_stairs))
+        #every awake monster's next action: it changes every turn, so it isn't in the monster's records
+        writer.table(SCHEDULE_RECORD, [(self.ref(monster), monster.fighter.next_time) for monster in active_monsters])
+
+        #the lists of objects, when they changed
+        writer.pack('B', self.objects_changed)
+        if self.objects_changed:
+            writer.table('i', [(self.ref(obj),) for obj in objects])
+        for old, new in zip(self.lists, lists):
+            writer.pack('B', old != new)
+            if old != new:
+                writer.table('i', [(i,) for i in new])
+        new_messages = len(self.messages) != len(game_msgs) or any(a is not b for a, b in zip(self.messages, game_msgs))
+        writer.pack('B', new_messages)
+        if new_messages:
+            writer.table('HH', [(writer.string(line), writer.color(color)) for (line, color) in game_msgs])
+
+        data = writer.data()
+        with open(self.filename + '.journal', 'ab') as file:
+            file.write(struct.pack('<I', len(data)) + data)
+        self.objects_changed = False
+        self.lists = lists
+        self.messages = list(game_msgs)
+        self.turns += 1
+
+def read_journal_entry(reader, state):
+    #apply a journal entry on top of a savegame read by read_savegame
+    read_globals(reader, state)
+    explored = [i for (i,) in reader.table('I')]
+    if numpy_available:
+        state['map'].explored[explored] = True
+    else:
+        for i in explored:
+            state['map'].explored[i] = 1
+
+    ids = [i for (i,) in reader.table('i')]
+    read_objects(reader, ids, state['records'])
+    state['stairs'], state['up_stairs'] = reader.unpack('2i')
+    state['schedule'] = reader.table(SCHEDULE_RECORD)
+    for name in ('objects', 'inventory', 'equipment', 'equipped'):
+        if reader.unpack('B')[0]:
+            state[name] = [i for (i,) in reader.table('i')]
+    if reader.unpack('B')[0]:
+        state['messages'] = [(reader.strings[line], reader.colors[color]) for (line, color) in reader.table('HH')]
+
+def mark_dirty(obj):
+    #an object changed this turn, and must go to the next journal entry
+    if journal.active:
+        journal.mark(obj)
+
+def objects_changed():
+    #the list of objects on the map changed (not just the objects in it)
+    journal.objects_changed = True
+
+def autosave(filename = 'savegame'):
+    #add this turn to the journal, or write a whole savegame on a new level and every JOURNAL_SNAPSHOT_TURNS turns
+    if journal.filename != filename or journal.map is not map or journal.turns >= JOURNAL_SNAPSHOT_TURNS:
+        save_game(filename)
+    else:
+        journal.write()
+
+def save_game(filename = 'savegame'):
+    writer = SaveWriter()
+    write_globals(writer)
+
+    #the map, one byte plane per layer
+    writer.pack('HH', map.width, map.height)
+    for layer in (map.blocked, map.block_sight, map.explored):
+        writer.layer(layer)
+
+    #the player first
+    table, ids = collect_objects([player, stairs, up_stairs] + objects + inventory + equipment + [equipped[part] for part in EQUIP_PARTS])
+    def ref(obj):
+        return ids[id(obj)] if obj else -1
+    write_objects(writer, table, ref)
+
+    #which objects are where: on the map, in the inventory, worn
+    writer.pack('2i', ref(stairs), ref(up_stairs))
+    writer.table(SCHEDULE_RECORD, [(ref(monster), monster.fighter.next_time) for monster in active_monsters])
+    for group in (objects, inventory, equipment):
+        writer.table('i', [(ids[id(obj)],) for obj in group])
+    writer.pack('5i', *[ref(equipped[part]) for part in EQUIP_PARTS])
+
+    writer.table('HH', [(writer.string(line), writer.color(color)) for (line, color) in game_msgs])
+
+    #the map may still be a view into the old savegame, which then couldn't be replaced on windows
+    map.own_layers()
+
+    #the old journal goes first: a crash in between loses turns, but never replays a journal on the wrong savegame
+    if os.path.exists(filename + '.journal'):
+        os.remove(filename + '.journal')
+    with open(filename + '.tmp', 'wb') as file:
+        file.write(writer.data())
+    replace_file(filename + '.tmp', filename)
+    journal.reset(filename, table, ids)
+    level_store.save(filename + '.levels')
+
+def write_level(level):
+    #a level from the level store, in the savegame format
+    writer = SaveWriter(LEVEL_MAGIC)
+    writer.pack('BHH', level.boss, level.map.width, level.map.height)
+    for layer in (level.map.blocked, level.map.block_sight, level.map.explored):
+        writer.layer(layer)
+
+    table, ids = collect_objects([level.stairs, level.up_stairs] + level.objects)
+    def ref(obj):
+        return ids[id(obj)] if obj else -1
+    write_objects(writer, table, ref)
+    writer.pack('2i', ref(level.stairs), ref(level.up_stairs))
+    writer.table('i', [(ids[id(obj)],) for obj in level.objects])
+    return writer.data()
+
+def read_level(reader, dungeon_level):
+    boss, width, height = reader.unpack('BHH')
+    level = Level(dungeon_level, Map(width, height, layers = [reader.layer(width * height) for i in range(3)]))
+    level.boss = bool(boss)
+
+    records = {}
+    read_objects(reader, None, records)
+    table = build_objects(records)
+    stairs, up_stairs = reader.unpack('2i')
+    level.stairs = table[stairs]
+    level.up_stairs = table[up_stairs] if up_stairs >= 0 else None
+    for (i,) in reader.table('i'):
+        level.add(table[i])
+    return level
+
+def read_savegame(reader):
+    #read a savegame into a state for build_game
+    state = {}
+    read_globals(reader, state)
+
+    width, height = reader.unpack('HH')
+    state['map'] = Map(width, height, layers = [reader.layer(width * height) for i in range(3)])
+
+    state['records'] = {}
+    read_objects(reader, None, state['records'])
+
+    state['stairs'], state['up_stairs'] = reader.unpack('2i')
+    state['schedule'] = reader.table(SCHEDULE_RECORD)
+    for name in ('objects', 'inventory', 'equipment'):
+        state[name] = [i for (i,) in reader.table('i')]
+    state['equipped'] = reader.unpack('5i')
+    state['messages'] = [(reader.strings[line], reader.colors[color]) for (line, color) in reader.table('HH')]
+    return state
+
+def load_game(filename = 'savegame'):
+    #read the savegame back, then replay its journal
+    global map, objects, object_index, player, inventory, equipment, equipped, game_msgs, game_state, stairs, up_stairs, dungeon_level, boss, gold, world_seed
+    global game_time, wake_count
+    global skill1, skill2, skill3, skill4
 
-        if game_state == 'playing' and player_action != 'didnt-take-turn':
-            for object in objects:
-                if object.ai:
-                    object.ai.take_turn()
-
-def save_game():
-    #open a new empty shelve (possibly overwriting an old one) to write game data
-    file = shelve.open('savegame', 'n')
-    file['map'] = map
-    file['objects'] = objects
-    file['player_index'] = objects.index(player)
-    file['inventory'] = inventory
-    file['equipment'] = equipment
-    file['equipped'] = equipped
-    file['game_msgs'] = game_msgs
-    file['game_state'] = game_state
-    file['stairs_index'] = objects.index(stairs)
-    file['dungeon_level'] = dungeon_level
-    file['boss'] = boss
-    file['gold'] = gold
-    file.close()
-
-def load_game():
-    #open the previously saved shelve and load the game data
-    global map, objects, player, inventory, equipment, equipped, game_msgs, game_state, stairs, dungeon_level, boss, gold
-
-    file = shelve.open('savegame', 'r')
-    map = file['map']
-    objects = file['objects']
-    player = objects[file['player_index']]
-    inventory = file['inventory']
-    equipment = file['equipment']
-    equipped = file['equipped']
-    game_msgs = file['game_msgs']
-    game_state = file['game_state']
-    stairs = objects[file['stairs_index']]
-    dungeon_level = file['dungeon_level']
-    boss = file['boss']
-    gold = file['gold']
-    print game_state
-    file.close()
-
+    #the file is mapped copy-on-write: the map layers are views into it, and changing them
+    #(exploring) never writes back to the file
+    with open(filename, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_COPY)
+    state = read_savegame(SaveReader(data))
+    if os.path.exists(filename + '.journal'):
+        with open(filename + '.journal', 'rb') as file:
+            data = file.read()
+        offset = 0
+        #an entry cut short by a crash is left out
+        while offset + 4 <= len(data):
+            size, = struct.unpack_from('<I', data, offset)
+            if offset + 4 + size > len(data):
+                break
+            read_journal_entry(SaveReader(data[offset + 4:offset + 4 + size], JOURNAL_MAGIC), state)
+            offset += 4 + size
+
+    (dungeon_level, gold, boss, game_state, world_seed, loot_draws, combat_draws, skill1, skill2, skill3, skill4,
+        game_time, wake_count) = state['globals']
+    map = state['map']
+    table = build_objects(state['records'])
+    player = table[0]
+    stairs = table[state['stairs']]
+    up_stairs = table[state['up_stairs']] if state['up_stairs'] >= 0 else None
+    objects, inventory, equipment = [[table[i] for i in state[name]] for name in ('objects', 'inventory', 'equipment')]
+    equipped = dict((part, table[i] if i >= 0 else None) for part, i in zip(EQUIP_PARTS, state['equipped']))
+    for i, time in state['schedule']:
+        table[i].fighter.next_time = time
+    game_msgs = state['messages']
+    start_streams(loot_draws, combat_draws)
+
+    journal.reset()
+    level_store.reset(filename + '.levels')
+    index_objects()
+    index_monsters()
     initialize_fov()
+    pregenerate_next_level()
 
-#init root
-libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'Game', False)
 #init offscreen
 con = libtcod.console_new(SCREEN_WIDTH, SCREEN_HEIGHT)
 
-libtcod.sys_set_fps(LIMIT_FPS)
-
 #gui
 panel = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT)
 
+#what the last frames left on the consoles, so render_all only draws what changed: the glyph
+#and color drawn on each tile of con, and what each part of the panel shows. the whole screen
+#is drawn again when screen_damaged is set (see redraw_screen)
+drawn_glyphs = {}
+panel_drawn = {}
+screen_damaged = True
+
 #mouse!
 mouse = libtcod.Mouse()
 key = libtcod.Key()
 
-main_menu()
+#objects on the map, bucketed by tile
+object_index = {}
+
+#monsters of the current level that are awake, in the order they woke up, and how many woke so far
+active_monsters = []
+wake_count = 0
+
+#the game time, and what happens next: a heap of (time, wake order, event, monster)
+game_time = 0
+schedule_events = []
+CONFUSION_ENDS, ACTS = range(2)
+
+#the player's distance map, and the tile it was computed from
+path_map = None
+distances = None
+distances_origin = None
+
+#the travel command in progress (see travel_step), and the distance maps of travel commands by kind
+travel_goal = None
+travel_steps = 0
+travel_maps = {}
+
+#timed wakeups of the game loop, a heap of (time, order, callback), and the spell effects
+#on screen, each a dict of the glyphs it draws by tile (see show_effect)
+wakeups = []
+wakeup_order = itertools.count()
+effects = []
+
+#random generators: one for the current level's generation, loot drops and combat. the
+#loot and combat streams are kept by stream, with how many numbers were drawn from each
+world_seed = 0
+streams = {}
+stream_draws = {}
+
+#what changed since the last autosave
+journal = Journal()
+
+#levels the player has left
+level_store = LevelStore()
+up_stairs = None
+
+#the monsters and items of the cfg files
+build_definitions()
+
+#the next level, generated in the background (set pregenerate_levels to False to generate levels on demand)
+pregenerate_levels = True
+level_job = None
+atexit.register(shutdown)
+
+#without a window (see headless.py), menus and targeting are answered by input_driver
+headless = False
+input_driver = None
+
+if __name__ == '__main__':
+    #init root
+    libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'Game', False)
+    libtcod.sys_set_fps(LIMIT_FPS)
+
+    main_menu()
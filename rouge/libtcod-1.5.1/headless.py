@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# headless simulation: play the game without a window, for balance testing
+# and benchmarking. run from this directory:
+#   python headless.py [turns] [seed]
+#
+import sys
+import time
+import game
+import libtcodpy as libtcod
+
+#named keys a driver can press, everything else is a single character
+KEYS = {'up': libtcod.KEY_UP, 'down': libtcod.KEY_DOWN, 'left': libtcod.KEY_LEFT,
+        'right': libtcod.KEY_RIGHT, 'escape': libtcod.KEY_ESCAPE, 'none': libtcod.KEY_NONE}
+
+def press(key, name):
+    #fill the game's Key struct as if the given key was pressed
+    key.lalt = False
+    if name in KEYS:
+        key.vk = KEYS[name]
+        key.c = 0
+    else:
+        key.vk = libtcod.KEY_CHAR
+        key.c = ord(name)
+
+class ScriptedDriver:
+    #replays a list of keys, then presses escape. menus and targeting use the given answers
+    def __init__(self, keys, choice = None, target = (None, None)):
+        self.keys = list(keys)
+        self.choice = choice
+        self.target = target
+
+    def next_key(self):
+        if self.keys:
+            return self.keys.pop(0)
+        return 'escape'
+
+    def choose(self, header, options):
+        return self.choice
+
+    def target_tile(self, max_range = None):
+        return self.target
+
+class RandomDriver:
+    #mostly walks around, sometimes picks things up, uses skills, travels and takes the stairs
+    MOVES = ['up', 'down', 'left', 'right']
+    ACTIONS = ['g', 'f', 'i', 'e', 'j', 'k', 'l', ',', 'x', 't', 'p']
+
+    def __init__(self, seed = 0):
+        self.rnd = libtcod.random_new_from_seed(seed)
+
+    def next_key(self):
+        if game.stairs.x == game.player.x and game.stairs.y == game.player.y and not game.boss:
+            return ','
+        if libtcod.random_get_int(self.rnd, 0, 9) > 0:
+            return self.MOVES[libtcod.random_get_int(self.rnd, 0, len(self.MOVES) - 1)]
+        return self.ACTIONS[libtcod.random_get_int(self.rnd, 0, len(self.ACTIONS) - 1)]
+
+    def choose(self, header, options):
+        if not options:
+            return None
+        return libtcod.random_get_int(self.rnd, 0, len(options) - 1)
+
+    def target_tile(self, max_range = None):
+        #the closest monster, if any is in range
+        monster = game.closest_monster(max_range or game.TORCH_RADIUS)
+        if monster is None:
+            return (None, None)
+        return (monster.x, monster.y)
+
+def simulate(driver, max_turns, seed = None):
+    #start a new game (from the given world seed) and play it until the player dies, quits
+    #or max_turns is reached. returns the number of turns played
+    game.headless = True
+    game.input_driver = driver
+    game.new_game(seed)
+
+    turns = 0
+    while turns < max_turns and game.game_state == 'playing':
+        if game.fov_recompute:
+            game.fov_recompute = False
+            game.update_fov()
+        game.check_level_up()
+
+        #no key while travelling, a key would stop it
+        press(game.key, 'none' if game.travel_goal else driver.next_key())
+        if game.play_turn() == 'exit':
+            break
+        turns += 1
+    return turns
+
+if __name__ == '__main__':
+    max_turns = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    start = time.time()
+    turns = simulate(RandomDriver(seed), max_turns, seed)
+    elapsed = time.time() - start
+    game.level_store.reset()
+
+    print '%d turns in %.2f s (%.0f turns/s)' % (turns, elapsed, turns / max(elapsed, 1e-9))
+    print 'state: %s, dungeon level %d, player level %d, hp %d/%d, gold %d' % (game.game_state,
+        game.dungeon_level, game.player.level, game.player.fighter.hp, game.player.fighter.max_hp, game.gold)
@@ -28,6 +28,7 @@
 import sys
 import ctypes
 import struct
+import array
 from ctypes import *
 
 if not hasattr(ctypes, "c_bool"):   # for Python < 2.6
@@ -464,8 +465,6 @@ class ConsoleBuffer:
             console_get_height(dest) != self.height):
             raise ValueError('ConsoleBuffer.blit: Destination console has an incorrect size.')
 
-        s = struct.Struct('%di' % len(self.back_r))
-
         if fill_back:
             _lib.TCOD_console_fill_background(dest, (c_int * len(self.back_r))(*self.back_r), (c_int * len(self.back_g))(*self.back_g), (c_int * len(self.back_b))(*self.back_b))
 
@@ -473,6 +472,86 @@ class ConsoleBuffer:
             _lib.TCOD_console_fill_foreground(dest, (c_int * len(self.fore_r))(*self.fore_r), (c_int * len(self.fore_g))(*self.fore_g), (c_int * len(self.fore_b))(*self.fore_b))
             _lib.TCOD_console_fill_char(dest, (c_int * len(self.char))(*self.char))
 
+class NumpyConsoleBuffer:
+    # a ConsoleBuffer kept in NumPy arrays of C ints, which blit hands to the
+    # "fill" functions as they are. back_r, back_g, back_b, fore_r, fore_g,
+    # fore_b and char are (height, width) views into one block of memory, so
+    # whole regions can be set with NumPy instead of cell by cell.
+    def __init__(self, width, height, back_r=0, back_g=0, back_b=0, fore_r=0, fore_g=0, fore_b=0, char=' '):
+        if not numpy_available:
+            raise ImportError('NumpyConsoleBuffer needs NumPy.')
+        self.width = width
+        self.height = height
+        self.planes = numpy.empty((7, height, width), dtype=numpy.intc)
+        (self.back_r, self.back_g, self.back_b,
+         self.fore_r, self.fore_g, self.fore_b, self.char) = self.planes
+        # the arrays never move, so their pointers are only made once
+        self._pointers = [plane.ctypes.data_as(POINTER(c_int)) for plane in self.planes]
+        self.clear(back_r, back_g, back_b, fore_r, fore_g, fore_b, char)
+
+    def clear(self, back_r=0, back_g=0, back_b=0, fore_r=0, fore_g=0, fore_b=0, char=' '):
+        # clears the console. values to fill it with are optional, defaults
+        # to black with no characters.
+        for plane, value in zip(self.planes, (back_r, back_g, back_b, fore_r, fore_g, fore_b, ord(char))):
+            plane.fill(value)
+
+    def copy(self):
+        # returns a copy of this NumpyConsoleBuffer.
+        other = NumpyConsoleBuffer(self.width, self.height)
+        other.planes[...] = self.planes
+        return other
+
+    def set_fore(self, x, y, r, g, b, char):
+        # set the character and foreground color of one cell.
+        self.planes[3:, y, x] = (r, g, b, ord(char))
+
+    def set_back(self, x, y, r, g, b):
+        # set the background color of one cell.
+        self.planes[:3, y, x] = (r, g, b)
+
+    def set(self, x, y, back_r, back_g, back_b, fore_r, fore_g, fore_b, char):
+        # set the background color, foreground color and character of one cell.
+        self.planes[:, y, x] = (back_r, back_g, back_b, fore_r, fore_g, fore_b, ord(char))
+
+    def _set_cells(self, where, back, fore, char):
+        # colors are Colors or (r, g, b), where each of r, g and b is a value
+        # or an array of one value per selected cell. so is char, as a code or
+        # a one-character string.
+        if back is not None:
+            self.back_r[where] = back[0]
+            self.back_g[where] = back[1]
+            self.back_b[where] = back[2]
+        if fore is not None:
+            self.fore_r[where] = fore[0]
+            self.fore_g[where] = fore[1]
+            self.fore_b[where] = fore[2]
+        if char is not None:
+            self.char[where] = ord(char) if isinstance(char, str) else char
+
+    def set_rect(self, x, y, w, h, back=None, fore=None, char=None):
+        # set the cells of a rectangle (cut to the buffer). what is None is
+        # left as it is.
+        self._set_cells((slice(max(y, 0), max(y + h, 0)), slice(max(x, 0), max(x + w, 0))), back, fore, char)
+
+    def set_mask(self, mask, back=None, fore=None, char=None):
+        # set the cells where mask, a boolean array of (height, width) or of
+        # one value per cell row by row, is true.
+        self._set_cells(numpy.asarray(mask, dtype=bool).reshape(self.height, self.width), back, fore, char)
+
+    def blit(self, dest, fill_fore=True, fill_back=True):
+        # write the buffer to a console with libtcod's "fill" functions, straight
+        # from the arrays.
+        if (console_get_width(dest) != self.width or
+            console_get_height(dest) != self.height):
+            raise ValueError('NumpyConsoleBuffer.blit: Destination console has an incorrect size.')
+
+        if fill_back:
+            _lib.TCOD_console_fill_background(dest, *self._pointers[:3])
+
+        if fill_fore:
+            _lib.TCOD_console_fill_foreground(dest, *self._pointers[3:6])
+            _lib.TCOD_console_fill_char(dest, self._pointers[6])
+
 _lib.TCOD_console_credits_render.restype = c_bool
 _lib.TCOD_console_is_fullscreen.restype = c_bool
 _lib.TCOD_console_is_window_closed.restype = c_bool
@@ -907,6 +986,27 @@ def console_delete(con):
     _lib.TCOD_console_delete(con)
 
 # fast color filling
+# the fill functions read one C int per cell. a contiguous array of C ints
+# (numpy.intc, int32 on the usual platforms) is passed as it is; any other
+# array is converted into scratch planes that are kept between calls, so
+# filling every frame doesn't allocate.
+_fill_planes = {}
+
+def _fill_scratch(n):
+    # four planes of n C ints (r, g, b and char), reused by every fill call.
+    planes = _fill_planes.get(n)
+    if planes is None:
+        planes = _fill_planes[n] = numpy.empty((4, n), dtype=numpy.intc)
+    return planes
+
+def _numpy_c_ints(arr, plane):
+    # pointer to the values of a NumPy array as C ints, copied into plane
+    # (a scratch plane of the same size) unless they already are.
+    if arr.dtype != numpy.intc or not arr.flags.c_contiguous:
+        plane.reshape(arr.shape)[...] = arr
+        arr = plane
+    return arr.ctypes.data_as(POINTER(c_int))
+
 def console_fill_foreground(con,r,g,b) :
     if len(r) != len(g) or len(r) != len(b):
         raise TypeError('R, G and B must all have the same size.')
@@ -914,12 +1014,10 @@ def console_fill_foreground(con,r,g,b) :
     if (numpy_available and isinstance(r, numpy.ndarray) and
         isinstance(g, numpy.ndarray) and isinstance(b, numpy.ndarray)):
         #numpy arrays, use numpy's ctypes functions
-        r = numpy.ascontiguousarray(r, dtype=numpy.int_)
-        g = numpy.ascontiguousarray(g, dtype=numpy.int_)
-        b = numpy.ascontiguousarray(b, dtype=numpy.int_)
-        cr = r.ctypes.data_as(POINTER(c_int))
-        cg = g.ctypes.data_as(POINTER(c_int))
-        cb = b.ctypes.data_as(POINTER(c_int))
+        planes = _fill_scratch(r.size)
+        cr = _numpy_c_ints(r, planes[0])
+        cg = _numpy_c_ints(g, planes[1])
+        cb = _numpy_c_ints(b, planes[2])
     else:
         # otherwise convert using ctypes arrays
         cr = (c_int * len(r))(*r)
@@ -935,12 +1033,10 @@ def console_fill_background(con,r,g,b) :
     if (numpy_available and isinstance(r, numpy.ndarray) and
         isinstance(g, numpy.ndarray) and isinstance(b, numpy.ndarray)):
         #numpy arrays, use numpy's ctypes functions
-        r = numpy.ascontiguousarray(r, dtype=numpy.int_)
-        g = numpy.ascontiguousarray(g, dtype=numpy.int_)
-        b = numpy.ascontiguousarray(b, dtype=numpy.int_)
-        cr = r.ctypes.data_as(POINTER(c_int))
-        cg = g.ctypes.data_as(POINTER(c_int))
-        cb = b.ctypes.data_as(POINTER(c_int))
+        planes = _fill_scratch(r.size)
+        cr = _numpy_c_ints(r, planes[0])
+        cg = _numpy_c_ints(g, planes[1])
+        cb = _numpy_c_ints(b, planes[2])
     else:
         # otherwise convert using ctypes arrays
         cr = (c_int * len(r))(*r)
@@ -952,14 +1048,89 @@ def console_fill_background(con,r,g,b) :
 def console_fill_char(con,arr) :
     if (numpy_available and isinstance(arr, numpy.ndarray) ):
         #numpy arrays, use numpy's ctypes functions
-        arr = numpy.ascontiguousarray(arr, dtype=numpy.int_)
-        carr = arr.ctypes.data_as(POINTER(c_int))
+        carr = _numpy_c_ints(arr, _fill_scratch(arr.size)[3])
     else:
         #otherwise convert using the struct module
         carr = struct.pack('%di' % len(arr), *arr)
 
     _lib.TCOD_console_fill_char(con, carr)
-        
+
+def _packed_rgb(rgb):
+    # pointers to the r, g and b of packed colors (three bytes per cell, as a
+    # NumPy array whose last axis is r, g, b, or a string or bytearray) as C ints.
+    if numpy_available:
+        if not isinstance(rgb, numpy.ndarray):
+            rgb = numpy.frombuffer(rgb, dtype=numpy.uint8)
+        rgb = rgb.reshape(-1, 3)
+        planes = _fill_scratch(len(rgb))
+        planes[:3].T[...] = rgb
+        return [plane.ctypes.data_as(POINTER(c_int)) for plane in planes[:3]]
+    rgb = bytearray(rgb)
+    return [(c_int * (len(rgb) // 3))(*rgb[i::3]) for i in range(3)]
+
+def console_fill_foreground_rgb(con, rgb) :
+    _lib.TCOD_console_fill_foreground(con, *_packed_rgb(rgb))
+
+def console_fill_background_rgb(con, rgb) :
+    _lib.TCOD_console_fill_background(con, *_packed_rgb(rgb))
+
+# draw many characters at once, leaving the background as it is. x, y and c
+# hold one position and character (code or one-character string) each, fore
+# one color each (Colors, (r, g, b) triples or an array of shape (n, 3)).
+# characters later in the lists are drawn over earlier ones on the same cell.
+# they all go to libtcod in one call, as C int arrays, converted with NumPy
+# from _PUT_CHARS_NUMPY characters on. libraries built before
+# TCOD_console_put_chars was added to wrappers.c don't have it, and then get
+# them one by one.
+_put_chars_available = hasattr(_lib, 'TCOD_console_put_chars')
+_PUT_CHARS_NUMPY = 64
+
+def console_put_chars(con, x, y, c, fore):
+    if len(x) != len(y) or len(x) != len(c) or len(x) != len(fore):
+        raise TypeError('x, y, c and fore must all have the same size.')
+
+    if not _put_chars_available:
+        w, h = console_get_width(con), console_get_height(con)
+        default = console_get_default_foreground(con)
+        for cx, cy, cc, cfore in zip(x, y, c, fore):
+            if 0 <= cx < w and 0 <= cy < h:
+                if not isinstance(cfore, Color):
+                    cfore = Color(cfore[0], cfore[1], cfore[2])
+                console_set_default_foreground(con, cfore)
+                console_put_char(con, cx, cy, cc, BKGND_NONE)
+        console_set_default_foreground(con, default)
+        return
+
+    n = len(x)
+    if not numpy_available or n < _PUT_CHARS_NUMPY:
+        c = [ord(cc) if type(cc) == str or type(cc) == bytes else cc for cc in c]
+        fore = [cfore if isinstance(cfore, Color) else Color(cfore[0], cfore[1], cfore[2]) for cfore in fore]
+        _lib.TCOD_console_put_chars(con, n, (c_int * n)(*x), (c_int * n)(*y), (c_int * n)(*c),
+                                    (c_int * n)(*[cfore.r for cfore in fore]),
+                                    (c_int * n)(*[cfore.g for cfore in fore]),
+                                    (c_int * n)(*[cfore.b for cfore in fore]))
+        return
+
+    if not isinstance(c, numpy.ndarray):
+        try:
+            c = numpy.fromiter(map(ord, c), dtype=numpy.intc, count=n)
+        except TypeError:
+            c = [ord(cc) if isinstance(cc, (str, bytes)) else cc for cc in c]
+    if not isinstance(fore, numpy.ndarray):
+        # colors are usually a few objects used over and over: convert each
+        # of them once
+        ids = numpy.fromiter(map(id, fore), dtype=numpy.uintp, count=n)
+        ids, first, which = numpy.unique(ids, return_index=True, return_inverse=True)
+        palette = [(fore[i][0], fore[i][1], fore[i][2]) for i in first]
+        fore = numpy.asarray(palette, dtype=numpy.intc).reshape(-1, 3)[which]
+    # x, y, c, r, g, b
+    cells = numpy.empty((6, n), dtype=numpy.intc)
+    cells[0] = x
+    cells[1] = y
+    cells[2] = c
+    cells[3:].T[...] = numpy.asarray(fore).reshape(-1, 3)
+    _lib.TCOD_console_put_chars(con, n, *[plane.ctypes.data_as(POINTER(c_int)) for plane in cells])
+
 def console_load_asc(con, filename) :
     _lib.TCOD_console_load_asc(con,filename)
 def console_save_asc(con, filename) :
@@ -1510,6 +1681,25 @@ NB_FOV_ALGORITHMS = 13
 def FOV_PERMISSIVE(p) :
     return FOV_PERMISSIVE_0+p
 
+# mirrors map_t from libtcod_int.h. each cell is one byte holding the
+# transparent (bit 0), walkable (bit 1) and fov (bit 2) flags.
+class _CMap(Structure):
+    _fields_ = [('width', c_int),
+                ('height', c_int),
+                ('nbcells', c_int),
+                ('cells', c_void_p),
+                ]
+
+_CELL_TRANSPARENT = 1
+_CELL_WALKABLE = 2
+_CELL_FOV = 4
+
+# translation table from a cell byte to 1 if it is in fov, 0 otherwise
+_CELL_FOV_TABLE = bytes(bytearray(1 if i & _CELL_FOV else 0 for i in range(256)))
+
+def _map_data(m):
+    return cast(c_void_p(m), POINTER(_CMap)).contents
+
 def map_new(w, h):
     return _lib.TCOD_map_new(w, h)
 
@@ -1519,6 +1709,23 @@ def map_copy(source, dest):
 def map_set_properties(m, x, y, isTrans, isWalk):
     _lib.TCOD_map_set_properties(m, x, y, c_int(isTrans), c_int(isWalk))
 
+# set the properties of every cell at once. transparent and walkable hold one
+# boolean per cell, row by row (NumPy arrays are used without a python loop).
+def map_set_properties_bulk(m, transparent, walkable):
+    data = _map_data(m)
+    if len(transparent) != data.nbcells or len(walkable) != data.nbcells:
+        raise TypeError('transparent and walkable must have one value per cell.')
+
+    if (numpy_available and isinstance(transparent, numpy.ndarray) and
+        isinstance(walkable, numpy.ndarray)):
+        cells = numpy.where(transparent, _CELL_TRANSPARENT, 0) | numpy.where(walkable, _CELL_WALKABLE, 0)
+        cells = numpy.ascontiguousarray(cells, dtype=numpy.uint8)
+        memmove(data.cells, cells.ctypes.data, data.nbcells)
+    else:
+        cells = bytearray((_CELL_TRANSPARENT if t else 0) | (_CELL_WALKABLE if w else 0)
+                          for t, w in zip(transparent, walkable))
+        memmove(data.cells, bytes(cells), data.nbcells)
+
 def map_clear(m,walkable=False,transparent=False):
     _lib.TCOD_map_clear(m,c_int(walkable),c_int(transparent))
 
@@ -1528,6 +1735,15 @@ def map_compute_fov(m, x, y, radius=0, light_walls=True, algo=FOV_RESTRICTIVE ):
 def map_is_in_fov(m, x, y):
     return _lib.TCOD_map_is_in_fov(m, x, y)
 
+# return the result of the last map_compute_fov for every cell at once, row by
+# row: a NumPy bool array if NumPy is available, a bytearray of 0/1 otherwise.
+def map_get_fov(m):
+    data = _map_data(m)
+    cells = string_at(data.cells, data.nbcells)
+    if numpy_available:
+        return (numpy.frombuffer(cells, dtype=numpy.uint8) & _CELL_FOV) != 0
+    return bytearray(cells.translate(_CELL_FOV_TABLE))
+
 def map_is_transparent(m, x, y):
     return _lib.TCOD_map_is_transparent(m, x, y)
 
@@ -1605,6 +1821,24 @@ _lib.TCOD_dijkstra_is_empty.restype = c_bool
 _lib.TCOD_dijkstra_path_walk.restype = c_bool
 _lib.TCOD_dijkstra_get_distance.restype = c_float
 
+# mirrors dijkstra_t from path_c.c. distances holds one unsigned int per cell,
+# row by row: the distance to the root times 100.
+class _CDijkstra(Structure):
+    _fields_ = [('diagonal_cost', c_int),
+                ('width', c_int),
+                ('height', c_int),
+                ('nodes_max', c_int),
+                ('map', c_void_p),
+                ('func', c_void_p),
+                ('user_data', c_void_p),
+                ('distances', c_void_p),
+                ('nodes', c_void_p),
+                ('path', c_void_p),
+                ]
+
+# distance of a cell that can't be reached from the root
+DIJKSTRA_UNREACHABLE = 0xFFFFFFFF
+
 def dijkstra_new(m, dcost=1.41):
     return (_lib.TCOD_dijkstra_new(c_void_p(m), c_float(dcost)), None)
 
@@ -1613,7 +1847,31 @@ def dijkstra_new_using_function(w, h, func, userdata=0, dcost=1.41):
     return (_lib.TCOD_path_dijkstra_using_function(w, h, cbk_func,
             py_object(userdata), c_float(dcost)), cbk_func)
 
+# TCOD_dijkstra_compute keeps reading its node queue past the last queued node,
+# up to the number of cells. whatever is left there (uninitialized memory, or
+# the queue of an earlier root) is processed again, and a cell that can't be
+# reached wraps its distance around, giving its walkable neighbours distances
+# like 99 or 140. so the queue is filled with the root first: going over the
+# root again changes nothing. each path keeps a queue full of its last root to
+# copy in, refilled only when the root changes.
+_dijkstra_queues = {}
+
 def dijkstra_compute(p, ox, oy):
+    data = cast(c_void_p(p[0]), POINTER(_CDijkstra)).contents
+    if data.nodes and 0 <= ox < data.width and 0 <= oy < data.height:
+        root = oy * data.width + ox
+        queue = _dijkstra_queues.get(p[0])
+        if queue is None or len(queue) != data.nodes_max:
+            queue = _dijkstra_queues[p[0]] = (c_uint * data.nodes_max)()
+        if queue[0] != root:
+            # fill it by copying the filled part after itself until it is full
+            queue[0] = root
+            filled = 1
+            while filled < data.nodes_max:
+                count = min(filled, data.nodes_max - filled)
+                memmove(addressof(queue) + filled * sizeof(c_uint), queue, count * sizeof(c_uint))
+                filled += count
+        memmove(data.nodes, queue, data.nodes_max * sizeof(c_uint))
     _lib.TCOD_dijkstra_compute(p[0], c_int(ox), c_int(oy))
 
 def dijkstra_path_set(p, x, y):
@@ -1622,6 +1880,16 @@ def dijkstra_path_set(p, x, y):
 def dijkstra_get_distance(p, x, y):
     return _lib.TCOD_dijkstra_get_distance(p[0], c_int(x), c_int(y))
 
+# the distance map of the last dijkstra_compute, one unsigned int per cell row
+# by row, in hundredths (DIJKSTRA_UNREACHABLE if the cell can't be reached).
+# a NumPy uint32 array if NumPy is available, an array.array otherwise.
+def dijkstra_get_distances(p):
+    data = cast(c_void_p(p[0]), POINTER(_CDijkstra)).contents
+    distances = string_at(data.distances, data.width * data.height * sizeof(c_uint))
+    if numpy_available:
+        return numpy.frombuffer(distances, dtype=numpy.uint32)
+    return array.array('I', distances)
+
 def dijkstra_size(p):
     return _lib.TCOD_dijkstra_size(p[0])
 
@@ -1645,6 +1913,7 @@ def dijkstra_path_walk(p):
     return None,None
 
 def dijkstra_delete(p):
+    _dijkstra_queues.pop(p[0], None)
     _lib.TCOD_dijkstra_delete(p[0])
 
 ############################
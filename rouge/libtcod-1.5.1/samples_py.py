@@ -1331,6 +1331,8 @@ if numpy_available:
 noise2d = libtcod.noise_new(2, 0.5, 2.0)
 if numpy_available:  #the texture starts empty
     texture = np.zeros((RES_U, RES_V))
+    #the colors of the screen, three bytes per tile, filled in place every frame
+    rgb = np.zeros((SCREEN_H, SCREEN_W, 3), dtype=np.uint8)
 
 #create lists to work without numpy
 texture2 = [0 for i in range(RES_U * RES_V)]
@@ -1492,13 +1494,13 @@ def render_py(first, key, mouse):
                     i += 1
 
     if use_numpy:
-        #truncate values
-        R = R.clip(0, 255)
-        G = G.clip(0, 255)
-        B = B.clip(0, 255)
+        #truncate values and pack them into the color buffer
+        rgb[..., 0] = R.clip(0, 255)
+        rgb[..., 1] = G.clip(0, 255)
+        rgb[..., 2] = B.clip(0, 255)
 
         #fill the screen with these background colors
-        libtcod.console_fill_background(sample_console, R, G, B)
+        libtcod.console_fill_background_rgb(sample_console, rgb)
     else:
         #truncate and convert to integer
         R2 = [int(min(r, 255)) for r in R2]
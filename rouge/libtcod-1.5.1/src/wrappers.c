@@ -200,6 +200,23 @@ void TCOD_console_fill_char(TCOD_console_t con, int *arr) {
 	}
 }
 
+/* n characters at positions x,y with colors r,g,b, leaving the background as it is */
+void TCOD_console_put_chars(TCOD_console_t con, int n, int *x, int *y, int *c, int *r, int *g, int *b) {
+	TCOD_console_data_t *dat = con ? (TCOD_console_data_t *)con : TCOD_ctx.root;
+	int i;
+	for (i=0; i < n; i++) {
+		if ( x[i] >= 0 && x[i] < dat->w && y[i] >= 0 && y[i] < dat->h
+			&& c[i] >= 0 && c[i] < TCOD_ctx.max_font_chars ) {
+			char_t *curchar=dat->buf + y[i] * dat->w + x[i];
+			curchar->c=c[i];
+			curchar->cf=TCOD_ctx.ascii_to_tcod[c[i]];
+			curchar->fore.r=r[i];
+			curchar->fore.g=g[i];
+			curchar->fore.b=b[i];
+		}
+	}
+}
+
 colornum_t
 TCOD_console_get_fading_color_wrapper ()
 {